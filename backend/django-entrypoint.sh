@@ -6,7 +6,6 @@ then
 
     python manage.py collectstatic --no-input --verbosity 0
     python manage.py migrate --no-input
-    python manage.py generateimages
 
     python manage.py shell -c "import setsitename"
 
@@ -15,7 +14,26 @@ then
     chown -RL django:101 /app/server/logs/ /app/media/
     find /app/ -type d -exec chmod g+s {} +
 
-    PORT=8000 su-exec django gunicorn practica.wsgi --timeout 180 --log-file -
+    # expired tokens are no longer deleted on the request path; the command retries failed purges itself,
+    # and is restarted should it exit anyway
+    (while true; do
+        su-exec django python manage.py purge_tokens --interval "${TOKEN_PURGE_INTERVAL:-3600}" || true
+        sleep 60
+    done) &
+
+    # logo sizes that are not ready yet, e.g. the ones of companies saved before they were tracked, or whose
+    # background rendition was lost to a restart
+    (while true; do
+        su-exec django python manage.py render_logos --interval "${LOGO_RENDER_INTERVAL:-3600}" || true
+        sleep 60
+    done) &
+
+    if [ "$SERVER_MODE" = "asgi" ]
+    then
+        PORT=8000 su-exec django gunicorn practica.asgi -k uvicorn.workers.UvicornWorker --timeout 180 --log-file -
+    else
+        PORT=8000 su-exec django gunicorn practica.wsgi --timeout 180 --log-file -
+    fi
 else
     exec python manage.py "$@"
 fi
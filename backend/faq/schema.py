@@ -4,6 +4,7 @@ from graphene_django import DjangoObjectType
 from graphene_django.filter import DjangoFilterConnectionField
 
 from faq.models import Faq
+from util.optimizer import optimize_queryset
 
 
 class FaqNode(DjangoObjectType):
@@ -11,6 +12,10 @@ class FaqNode(DjangoObjectType):
         model = Faq
         interfaces = (relay.Node,)
 
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
 
 class FaqFilterSet(django_filters.FilterSet):
     @property
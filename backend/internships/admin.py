@@ -6,16 +6,22 @@ from django.core import mail
 from django.core.exceptions import PermissionDenied
 from django.core.mail import EmailMessage
 from django.db.models import Count
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, Http404
 from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
 from django.urls import reverse, path
+from django.utils import timezone
 from django.utils.html import format_html
 from imagekit.admin import AdminThumbnail
 from import_export import resources
 from import_export.admin import ExportActionModelAdmin
+from private_storage.models import PrivateFile
+from private_storage.views import PrivateStorageView
 from reversion_compare.admin import CompareVersionAdmin
 
+from util.admin import StreamingExportMixin, get_staff_group_ids
+from util.helpers import encode_content_disposition_filename
+from .exports import BulkExport
 from .models import Company, InternshipOffer, CompanyContact, InternshipTag
 
 
@@ -40,13 +46,13 @@ class CompanyResource(resources.ModelResource):
         return company.total_capacity
 
     def dehydrate_applicant_count(self, company):
-        return company.applicants.count()
+        return company.applicant_count
 
     def dehydrate_export_url(self, company):
         return build_absolute_uri(None, company.applicants_export_url)
 
     def dehydrate_contacts(self, company):
-        return ';'.join(f'{contact.name} <{contact.email}>' for contact in company.contacts.all())
+        return ';'.join(contact.email for contact in company.contacts.all())
 
     class Meta:
         model = Company
@@ -55,20 +61,20 @@ class CompanyResource(resources.ModelResource):
 
 
 @admin.register(Company)
-class CompanyAdmin(ExportActionModelAdmin, CompareVersionAdmin):
+class CompanyAdmin(StreamingExportMixin, ExportActionModelAdmin, CompareVersionAdmin):
     inlines = [CompanyContactAdmin,]
     list_display = ('logo_thumbnail', '__str__', 'visible_for_students', 'preview')
     list_display_links = ('logo_thumbnail', '__str__')
     logo_thumbnail = AdminThumbnail(image_field='logo_32h')
     resource_class = CompanyResource
+    export_prefetch_related = ('contacts',)
     change_list_template = 'admin/import_export/change_list_export.html'
 
     def get_queryset(self, request):
-        user = request.user
-        qs = super(CompanyAdmin, self).get_queryset(request).distinct()
-        if user.is_staff and not user.is_superuser:
-            groups = user.groups.all()
-            qs = qs.filter(group__in=groups)  # userul vede doar companiile din grupul in care e assignat
+        qs = super(CompanyAdmin, self).get_queryset(request)
+        group_ids = get_staff_group_ids(request)
+        if group_ids is not None:
+            qs = qs.filter(group__in=group_ids)  # userul vede doar companiile din grupul in care e assignat
         return qs
 
     def get_fields(self, request, obj=None):
@@ -90,6 +96,93 @@ class CompanyAdmin(ExportActionModelAdmin, CompareVersionAdmin):
 
     preview.allow_tags = True
 
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                'exports/<str:job_id>/',
+                self.admin_site.admin_view(self.bulk_export_view),
+                name='internships_company_bulk_export',
+            ),
+            path(
+                'exports/<str:job_id>/download/',
+                self.admin_site.admin_view(self.bulk_export_download_view),
+                name='internships_company_bulk_export_download',
+            ),
+        ]
+        return custom_urls + urls
+
+    def export_applicants_bulk_action(self, request, queryset):
+        """
+        Builds the applicant exports of the selected companies in the background pool, and redirects to a page
+        following their progress, from which they can be downloaded.
+        """
+        if not request.user.is_superuser:
+            raise PermissionDenied('Not authorized to export applicants')
+
+        job = BulkExport.start(queryset.order_by('name'))
+        return HttpResponseRedirect(reverse('admin:internships_company_bulk_export', args=[job.job_id],
+                                            current_app=self.admin_site.name))
+
+    export_applicants_bulk_action.short_description = 'Export applicants of selected %(verbose_name_plural)s'
+
+    actions = [export_applicants_bulk_action]
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if not request.user.is_superuser:
+            actions.pop('export_applicants_bulk_action', None)
+        return actions
+
+    def get_bulk_export(self, request, job_id):
+        if not request.user.is_superuser:
+            raise PermissionDenied('Not authorized to export applicants')
+        job = BulkExport.get(job_id)
+        if job is None:
+            raise Http404('Export not found or expired')
+        return job
+
+    def bulk_export_view(self, request, job_id):
+        job = self.get_bulk_export(request, job_id)
+        results = job.get_results()
+        companies = Company.objects.in_bulk(job.companies)
+
+        exports = []
+        for company_pk in job.companies:
+            name, error = results.get(company_pk, (None, None))
+            exports.append({
+                'company': companies.get(company_pk),
+                'done': company_pk in results,
+                'ready': bool(name),
+                'error': error,
+            })
+
+        context = self.admin_site.each_context(request)
+        context['opts'] = self.model._meta
+        context['title'] = 'Export applicants'
+        context['exports'] = exports
+        context['done'] = len(results)
+        context['total'] = len(job.companies)
+        context['finished'] = job.is_finished(results)
+        context['download_url'] = reverse('admin:internships_company_bulk_export_download', args=[job_id],
+                                          current_app=self.admin_site.name)
+
+        return TemplateResponse(request, 'admin/practica/company_bulk_export.html', context)
+
+    def bulk_export_download_view(self, request, job_id):
+        job = self.get_bulk_export(request, job_id)
+        if not job.is_finished():
+            return HttpResponseRedirect(reverse('admin:internships_company_bulk_export', args=[job_id],
+                                                current_app=self.admin_site.name))
+
+        # like a single bundle, the file itself is sent by the private storage server
+        name = job.get_archive()
+        response = PrivateStorageView.server_class().serve(PrivateFile(request, job.storage, name))
+        timestamp = timezone.localtime(job.storage.get_modified_time(name))
+        export_filename = f'practica-ligaac-ro-{timestamp:%Y-%m-%d_%H-%M-%S}.zip'
+        response['Content-Disposition'] = 'attachment; ' + encode_content_disposition_filename(export_filename)
+        return response
+
     # def get_urls(self):
     #     urls = super().get_urls()
     #     custom_urls = [
@@ -173,35 +266,34 @@ class CompanyAdmin(ExportActionModelAdmin, CompareVersionAdmin):
 
 
 @admin.register(InternshipOffer)
-class InternshipOfferAdmin(ExportActionModelAdmin, CompareVersionAdmin):
+class InternshipOfferAdmin(StreamingExportMixin, ExportActionModelAdmin, CompareVersionAdmin):
     list_display = ('__str__', 'company', 'internship_tags', )
+    export_prefetch_related = ('tags',)
     list_display_links = ('__str__', 'company')
     search_fields = ('title', 'tags__name' )
     filter_horizontal = ('tags',)
 
     def get_queryset(self, request):
-        user = request.user
-        qs = super().get_queryset(request).distinct()
-        if user.is_staff and not user.is_superuser:
-            groups = user.groups.all()
-            qs = qs.filter(company__group__in=groups)
+        qs = super().get_queryset(request)
+        group_ids = get_staff_group_ids(request)
+        if group_ids is not None:
             # userul vede doar internshipurile companiei din grupul in care e asignat
+            qs = qs.filter(company__group__in=group_ids)
         return qs
 
     def internship_tags(self, obj):
         return ", ".join([p.name for p in obj.tags.all()])
 
     def get_form(self, request, obj=None, **kwargs):
-        user = request.user
         form = super(InternshipOfferAdmin, self).get_form(request, obj, **kwargs)
-        if user.is_staff and not user.is_superuser:
-            groups = user.groups.all()
-            form.base_fields['company'].queryset = Company.objects.filter(group__in=groups)
+        group_ids = get_staff_group_ids(request)
+        if group_ids is not None:
+            form.base_fields['company'].queryset = Company.objects.filter(group__in=group_ids)
         return form
 
 
 @admin.register(InternshipTag)
-class InternshipTagAdmin(ExportActionModelAdmin, CompareVersionAdmin):
+class InternshipTagAdmin(StreamingExportMixin, ExportActionModelAdmin, CompareVersionAdmin):
     pass
 
 
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class InternshipsConfig(AppConfig):
     name = 'internships'
+
+    def ready(self):
+        # noinspection PyUnresolvedReferences
+        import internships.signals  # noqa: F401
@@ -0,0 +1,67 @@
+from django.db.models import Count, OuterRef, Subquery, Sum, IntegerField
+from django.db.models.functions import Coalesce
+
+from internships.directory import invalidate_directory_companies
+from internships.models import Company, InternshipOffer
+
+
+def get_applications_model():
+    from students.models import StudentProfile
+    return StudentProfile.applications.through
+
+
+def count_subquery(queryset, group_by, aggregate):
+    """
+    Wrap ``aggregate`` over ``queryset``, grouped by ``group_by``, as a subquery that is 0 when there are no rows.
+    """
+    queryset = queryset.order_by().values(group_by).annotate(value=aggregate).values('value')
+    return Coalesce(Subquery(queryset, output_field=IntegerField()), 0)
+
+
+def update_internship_counters(internship_ids=None):
+    """
+    Recompute the denormalized ``applicant_count`` of the given internship offers (all of them by default)
+    with a single ``UPDATE``.
+    """
+    applications = get_applications_model().objects.filter(internshipoffer=OuterRef('pk'))
+    offers = InternshipOffer.objects.all()
+    if internship_ids is not None:
+        offers = offers.filter(pk__in=internship_ids)
+
+    offers.update(applicant_count=count_subquery(applications, 'internshipoffer', Count('pk')))
+
+
+def update_company_counters(company_ids=None):
+    """
+    Recompute the denormalized ``num_internships``, ``total_capacity`` and ``applicant_count`` of the given
+    companies (all of them by default) with a single ``UPDATE``.
+    """
+    offers = InternshipOffer.objects.filter(company=OuterRef('pk'))
+    applications = get_applications_model().objects.filter(internshipoffer__company=OuterRef('pk'))
+    companies = Company.objects.all()
+    if company_ids is not None:
+        companies = companies.filter(pk__in=company_ids)
+
+    companies.update(
+        num_internships=count_subquery(offers, 'company', Count('pk')),
+        total_capacity=count_subquery(offers, 'company', Sum('capacity')),
+        applicant_count=count_subquery(applications, 'internshipoffer__company',
+                                       Count('studentprofile', distinct=True)),
+    )
+
+
+def update_application_counters(internship_ids):
+    """
+    Recompute the applicant counts of the given internship offers and of their companies, after
+    applications to them were added or removed. Returns the ids of the companies.
+    """
+    internship_ids = list(internship_ids)
+    if not internship_ids:
+        return set()
+
+    company_ids = set(InternshipOffer.objects.filter(pk__in=internship_ids).values_list('company_id', flat=True))
+    update_internship_counters(internship_ids)
+    update_company_counters(company_ids)
+    # only the cached companies are stale, the directory index itself didn't change
+    invalidate_directory_companies(company_ids)
+    return company_ids
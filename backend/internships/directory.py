@@ -0,0 +1,135 @@
+import random
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from internships.models import Company
+
+DIRECTORY_CACHE_KEY = 'internships.company_directory'
+DIRECTORY_VERSION_KEY = 'internships.company_directory.version'
+
+
+class CompanyDirectory(object):
+    """
+    Index of the companies visible for students, as served by the ``companies`` query.
+
+    The index itself only holds the company ids; the companies are cached under one key each,
+    so a page of results only loads the companies on that page. The cached companies have their
+    logo sizes already resolved, so they can be served without touching the database or the logo storage.
+    """
+
+    def __init__(self, version, ids, ids_with_internships):
+        self.version = version
+        self.ids = tuple(ids)
+        self.ids_with_internships = frozenset(ids_with_internships)
+
+    @classmethod
+    def build(cls, version):
+        companies = cls.load_companies(Company.objects.filter(visible_for_students=True).order_by('pk'))
+        directory = cls(version,
+                        ids=[company.pk for company in companies],
+                        ids_with_internships=[company.pk for company in companies if company.num_internships > 0])
+        directory.cache_companies(companies)
+        return directory
+
+    @staticmethod
+    def load_companies(queryset):
+        companies = list(queryset)
+        for company in companies:
+            # evaluate the cached property before pickling the company
+            company.logo_sizes
+        return companies
+
+    def get_company_key(self, pk):
+        return f'{DIRECTORY_CACHE_KEY}.{self.version}.{pk}'
+
+    def cache_companies(self, companies):
+        cache.set_many({self.get_company_key(company.pk): company for company in companies},
+                       timeout=settings.COMPANY_DIRECTORY_CACHE_TIMEOUT)
+
+    def get_companies(self, ids):
+        """
+        Return the companies with the given ids, in the same order. Companies evicted from the cache
+        are loaded from the database and cached again.
+        """
+        keys = {pk: self.get_company_key(pk) for pk in ids}
+        cached = cache.get_many(keys.values())
+        companies = {pk: cached[key] for pk, key in keys.items() if key in cached}
+
+        missing = [pk for pk in ids if pk not in companies]
+        if missing:
+            loaded = self.load_companies(Company.objects.filter(pk__in=missing))
+            self.cache_companies(loaded)
+            companies.update((company.pk, company) for company in loaded)
+
+        return [companies[pk] for pk in ids if pk in companies]
+
+    def get_ids(self, has_internships=False, seed=None):
+        """
+        Return the company ids in a random order. The order is a deterministic function of ``seed``
+        if given, so clients that reuse a seed get stable pagination cursors.
+        """
+        ids = [pk for pk in self.ids if pk in self.ids_with_internships] if has_internships else list(self.ids)
+        random.Random(seed).shuffle(ids)
+        return ids
+
+
+class CompanySequence(object):
+    """
+    Lazy sequence of directory companies. Slicing only slices the ids; the companies are loaded
+    from the cache when the (sliced) sequence is iterated.
+    """
+
+    def __init__(self, directory, ids):
+        self.directory = directory
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return CompanySequence(self.directory, self.ids[item])
+
+        return self.directory.get_companies([self.ids[item]])[0]
+
+    def __iter__(self):
+        return iter(self.directory.get_companies(self.ids))
+
+
+def get_directory_version():
+    # a random token instead of a counter, so an evicted version key can never resurrect an old snapshot
+    return cache.get_or_set(DIRECTORY_VERSION_KEY, lambda: uuid.uuid4().hex, timeout=None)
+
+
+def get_company_directory():
+    """
+    Return the current ``CompanyDirectory``, building and caching it if the cached version is missing or stale.
+    """
+    version = get_directory_version()
+    key = f'{DIRECTORY_CACHE_KEY}.{version}'
+    directory = cache.get(key)
+    if directory is None:
+        directory = CompanyDirectory.build(version)
+        cache.set(key, directory, timeout=settings.COMPANY_DIRECTORY_CACHE_TIMEOUT)
+
+    return directory
+
+
+def invalidate_company_directory():
+    """
+    Change the directory version so the next ``get_company_directory`` call rebuilds the snapshot.
+    Old snapshots are never read again and simply expire from the cache.
+    """
+    cache.set(DIRECTORY_VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def invalidate_directory_companies(pks):
+    """
+    Drop the cached copies of the given companies, which are reloaded from the database when next requested.
+    Enough for changes that don't affect which companies are listed, like their applicant counts.
+    """
+    directory_version = get_directory_version()
+    directory = CompanyDirectory(directory_version, ids=(), ids_with_internships=())
+    cache.delete_many([directory.get_company_key(pk) for pk in pks])
@@ -0,0 +1,382 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+from functools import partial
+from tempfile import TemporaryFile
+
+import pytz
+from allauth.utils import build_absolute_uri
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction, close_old_connections
+from django.db.models import Count, Max
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from import_export import resources
+from openpyxl import Workbook
+from private_storage.storage import private_storage
+
+from internships.models import Company
+from students.models import StudentProfile
+from util.background import run_in_background
+from util.zipstream import StreamingZipSeeker, file_size
+
+# bump when the layout of the bundles changes, so the ones already stored are rebuilt
+EXPORT_BUNDLE_VERSION = 2
+EXPORT_BUNDLE_DIR = 'exports'
+EXPORT_PENDING_CACHE_KEY = 'internships.export_pending'
+EXPORT_JOB_CACHE_KEY = 'internships.export_job'
+EXPORT_JOB_TIMEOUT = 24 * 60 * 60
+# superseded bundles are kept this long, in case they are still being downloaded
+EXPORT_BUNDLE_GRACE_PERIOD = 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def store_zip(storage, name, z):
+    """
+    Write the archive ``z`` to the file system storage under ``name``. It is written under a temporary name
+    first, so it is never served half-written.
+    """
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial_path = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+    try:
+        with open(partial_path, 'wb') as f:
+            for block in z.blocks():
+                f.write(block)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def get_cv_info(profile):
+    """
+    Return the file name, the name in the export archive and the absolute download URL of a profile's CV,
+    or ``(None, None, None)`` if it has none. Computed once per profile and reused by every column and file
+    of the export, as resolving the file name goes through the storage.
+    """
+    if '_cv_info' not in profile.__dict__:
+        cv_info = None, None, None
+        if profile.cv:
+            filename = get_valid_filename(os.path.basename(profile.cv.path))
+            name, ext = os.path.splitext(filename)
+            url = reverse('download_student_cv', kwargs={'pk': profile.id, 'basename': filename})
+            cv_info = filename, f'cv/{name}@{profile.id}{ext}', build_absolute_uri(None, url)
+        profile._cv_info = cv_info
+
+    return profile._cv_info
+
+
+class ApplicantProfileResource(resources.ModelResource):
+    id = resources.Field(attribute='id', readonly=True)
+    study_class = resources.Field(column_name='class')
+    first_name = resources.Field(attribute='user__first_name', column_name='first_name')
+    last_name = resources.Field(attribute='user__last_name', column_name='last_name')
+    phone = resources.Field(attribute='phone', column_name='tel')
+    email = resources.Field(attribute='user__email', column_name='email')
+    cv_filename = resources.Field(column_name='cv_filename')
+    cv_url = resources.Field(column_name='cv_url')
+
+    def dehydrate_study_class(self, profile):
+        return str(profile.study_class)
+
+    def dehydrate_cv_url(self, profile):
+        return get_cv_info(profile)[2] or ""
+
+    def dehydrate_cv_filename(self, profile):
+        return get_cv_info(profile)[1] or ""
+
+    class Meta:
+        model = StudentProfile
+        fields = ('id', 'study_class', 'last_name', 'first_name', 'phone', 'email', 'cv_url', 'cv_filename',
+                  'linkedin', 'github')
+        export_order = fields
+
+
+class ApplicantsExport(object):
+    """
+    The applicants of a company as a ZIP with a CSV and an XLSX of their profiles, and their CVs.
+
+    The applicants are read in a single pass over a database cursor (see ``write_tables``), which writes
+    both tables to anonymous temporary files as it goes, so only the paths of the CVs are kept in memory.
+    The archive is uncompressed, so its size is known before the first byte is generated.
+
+    Bundles are stored in the private storage under a key derived from the applications and the profiles
+    (see ``get_key``), so an unchanged export is never built twice. Superseded bundles are only removed
+    after ``EXPORT_BUNDLE_GRACE_PERIOD``, so a download that already started is never cut short.
+    """
+    resource_class = ApplicantProfileResource
+    storage = private_storage
+
+    def __init__(self, company):
+        self.company = company
+
+    def get_applicants(self):
+        return StudentProfile.objects.filter(applications__company=self.company).distinct() \
+            .select_related('user', 'study_class').order_by('pk')
+
+    def get_entries(self):
+        """
+        Yield the exported row of every applicant, with the path and archive name of their CV (``None`` if
+        they have none).
+        """
+        resource = self.resource_class()
+        for applicant in self.get_applicants().iterator():
+            row = [value if value is None or isinstance(value, (int, float)) else str(value)
+                   for value in resource.export_resource(applicant)]
+            _, cv_zipname, _ = get_cv_info(applicant)
+            yield row, applicant.cv.path if cv_zipname else None, cv_zipname
+
+    def write_tables(self):
+        """
+        Write the CSV and the XLSX of the applicants to anonymous temporary files, in a single pass over the
+        applicants, and return both files with the ``(path, archive name)`` of every CV.
+        """
+        headers = self.resource_class().get_export_headers()
+
+        # removed from the file system as soon as it is created, and closed once streamed
+        csv_file = TemporaryFile()
+        csv_text = io.TextIOWrapper(csv_file, encoding='utf-8', newline='')
+        writer = csv.writer(csv_text)
+        writer.writerow(headers)
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(headers)
+
+        cv_files = []
+        for row, cv_path, cv_zipname in self.get_entries():
+            writer.writerow(row)
+            sheet.append(row)
+            if cv_zipname:
+                cv_files.append((cv_path, cv_zipname))
+
+        csv_text.flush()
+        csv_text.detach()
+        xlsx_file = TemporaryFile()
+        workbook.save(xlsx_file)
+        return csv_file, xlsx_file, cv_files
+
+    @staticmethod
+    def read_and_close(fileobj):
+        try:
+            yield from iter(lambda: fileobj.read(io.DEFAULT_BUFFER_SIZE), b'')
+        finally:
+            fileobj.close()
+
+    def get_zip(self, timestamp):
+        z = StreamingZipSeeker()
+        csv_file, xlsx_file, cv_files = self.write_tables()
+
+        z.add_generated(lambda: self.read_and_close(csv_file), f'date-studenti-{timestamp}.csv',
+                        file_size(csv_file))
+        z.add_generated(lambda: self.read_and_close(xlsx_file), f'date-studenti-{timestamp}.xlsx',
+                        file_size(xlsx_file))
+
+        for path, zipname in cv_files:
+            z.add(path, zipname)
+
+        return z
+
+    def get_key(self):
+        """
+        Derive the key of the current bundle from the number of applications to the company, the newest of them
+        and the last time one of the applicants' profiles was saved, with a single aggregate query. Adding or
+        removing an application changes the first two, and a profile is saved whenever its exported fields,
+        its CV or its user change (see ``internships.signals``).
+        """
+        aggregate = StudentProfile.applications.through.objects \
+            .filter(internshipoffer__company=self.company) \
+            .aggregate(count=Count('pk'), last=Max('pk'), modified=Max('studentprofile__modified_date'))
+        modified = aggregate['modified'].isoformat() if aggregate['modified'] else ''
+        key = f'{EXPORT_BUNDLE_VERSION}\n{aggregate["count"]}\n{aggregate["last"]}\n{modified}'
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get_bundle_dir(self):
+        return f'{EXPORT_BUNDLE_DIR}/{self.company.pk}'
+
+    def get_bundle_name(self, key):
+        return f'{self.get_bundle_dir()}/{key}.zip'
+
+    def get_bundle(self, key=None):
+        """
+        Return the storage name of the bundle with the given key (the current one by default), building and
+        storing it if needed.
+        """
+        name = self.get_bundle_name(key or self.get_key())
+        if not self.storage.exists(name):
+            self.build_bundle(name)
+        return name
+
+    def build_bundle(self, name):
+        timestamp = datetime.now(tz=pytz.timezone('Europe/Bucharest')).strftime('%Y-%m-%d_%H-%M-%S')
+        store_zip(self.storage, name, self.get_zip(timestamp))
+        self.remove_old_bundles(name)
+
+    def remove_old_bundles(self, current_name):
+        """
+        Delete the bundles that were superseded by a newer one more than ``EXPORT_BUNDLE_GRACE_PERIOD``
+        seconds ago, i.e. whose successor was stored before that.
+        """
+        _, filenames = self.storage.listdir(self.get_bundle_dir())
+        bundles = sorted((self.storage.get_modified_time(name), name)
+                         for name in (f'{self.get_bundle_dir()}/{filename}' for filename in filenames
+                                      if filename.endswith('.zip')))
+        now = timezone.now()
+        for (_, name), (superseded, _) in zip(bundles, bundles[1:]):
+            if name != current_name and (now - superseded).total_seconds() > EXPORT_BUNDLE_GRACE_PERIOD:
+                self.storage.delete(name)
+
+
+def get_export_pending_key(company_pk):
+    return f'{EXPORT_PENDING_CACHE_KEY}.{company_pk}'
+
+
+def build_company_export(company_pk):
+    """
+    Build the export bundle of a company, unless it is up to date, and return its storage name
+    (``None`` if the company doesn't exist). Runs in a background worker.
+    """
+    # cleared before building, so changes made while the bundle is built schedule another build
+    cache.delete(get_export_pending_key(company_pk))
+    close_old_connections()
+    try:
+        company = Company.objects.filter(pk=company_pk).first()
+        if company:
+            return ApplicantsExport(company).get_bundle()
+    finally:
+        close_old_connections()
+
+
+def schedule_company_exports(company_ids):
+    """
+    Rebuild the export bundles of the given companies in the background, once the current transaction commits,
+    so the next download is just a file send.
+
+    Rebuilds are started ``EXPORT_REBUILD_DELAY`` seconds later, and a company already waiting for one isn't
+    queued again, so a burst of changes (e.g. students applying one after the other) is coalesced into a single
+    rebuild. The view still builds an outdated bundle on demand, so a download never waits for the delay.
+    """
+    def schedule():
+        for company_pk in company_ids:
+            key = get_export_pending_key(company_pk)
+            if cache.add(key, True, timeout=settings.EXPORT_REBUILD_DELAY + 10 * 60):
+                # the worker can't clear a process-local cache, so clear it from here as well
+                args = (build_company_export, company_pk)
+                kwargs = {'callback': lambda _, key=key: cache.delete(key)}
+                if settings.BACKGROUND_TASK_WORKERS and settings.EXPORT_REBUILD_DELAY:
+                    timer = threading.Timer(settings.EXPORT_REBUILD_DELAY, run_in_background, args, kwargs)
+                    timer.daemon = True
+                    timer.start()
+                else:
+                    run_in_background(*args, **kwargs)
+
+    transaction.on_commit(schedule)
+
+
+def build_bulk_export_item(company_pk):
+    """
+    Like ``build_company_export``, but reports failures as a result, so a bulk export always completes.
+    """
+    try:
+        return build_company_export(company_pk), None
+    except Exception as e:
+        logger.exception("export of company %s failed", company_pk)
+        return None, str(e) or e.__class__.__name__
+
+
+class BulkExport(object):
+    """
+    The exports of several companies, built in parallel by the background pool (see ``start``). Its progress
+    is kept in the cache, with a key per company, so the workers' results never overwrite each other and
+    any web worker can report it. Once finished, the bundles can be downloaded one by one or as a single
+    archive, which is stored like the bundles so it can be sent by the private storage server (see
+    ``get_archive``).
+    """
+    storage = private_storage
+
+    def __init__(self, job_id, companies):
+        self.job_id = job_id
+        # company pk -> slug, in the order they are listed
+        self.companies = companies
+
+    @classmethod
+    def start(cls, companies):
+        job = cls(uuid.uuid4().hex, {company.pk: company.slug for company in companies})
+        cache.set(job.get_cache_key(), job.companies, timeout=EXPORT_JOB_TIMEOUT)
+        for company_pk in job.companies:
+            run_in_background(build_bulk_export_item, company_pk, callback=partial(job.item_done, company_pk))
+        return job
+
+    @classmethod
+    def get(cls, job_id):
+        companies = cache.get(f'{EXPORT_JOB_CACHE_KEY}.{job_id}')
+        return cls(job_id, companies) if companies is not None else None
+
+    def get_cache_key(self, company_pk=None):
+        key = f'{EXPORT_JOB_CACHE_KEY}.{self.job_id}'
+        return key if company_pk is None else f'{key}.{company_pk}'
+
+    def item_done(self, company_pk, result):
+        cache.set(self.get_cache_key(company_pk), result, timeout=EXPORT_JOB_TIMEOUT)
+
+    def get_results(self):
+        """
+        Map the pk of every finished company to its ``(bundle name, error)``.
+        """
+        keys = {self.get_cache_key(company_pk): company_pk for company_pk in self.companies}
+        return {keys[key]: result for key, result in cache.get_many(keys).items()}
+
+    def is_finished(self, results=None):
+        return len(self.get_results() if results is None else results) == len(self.companies)
+
+    def get_zip(self):
+        """
+        Return an archive with the bundle of every company, named by the company's slug.
+        """
+        results = self.get_results()
+        z = StreamingZipSeeker()
+        for company_pk, slug in self.companies.items():
+            name, _ = results.get(company_pk, (None, None))
+            if name and not self.storage.exists(name):
+                # rebuilt since, when applications changed
+                name = self.get_latest_bundle(company_pk)
+            if name:
+                z.add(self.storage.path(name), f'{slug}.zip')
+        return z
+
+    def get_archive(self):
+        """
+        Return the storage name of the archive of a finished export (see ``get_zip``), assembling and storing
+        it on first use.
+        """
+        name = f'{EXPORT_BUNDLE_DIR}/bulk/{self.job_id}.zip'
+        if not self.storage.exists(name):
+            store_zip(self.storage, name, self.get_zip())
+            self.remove_expired_archives()
+        return name
+
+    def remove_expired_archives(self):
+        _, filenames = self.storage.listdir(f'{EXPORT_BUNDLE_DIR}/bulk')
+        now = timezone.now()
+        for filename in filenames:
+            name = f'{EXPORT_BUNDLE_DIR}/bulk/{filename}'
+            if filename.endswith('.zip') and \
+                    (now - self.storage.get_modified_time(name)).total_seconds() > EXPORT_JOB_TIMEOUT:
+                self.storage.delete(name)
+
+    def get_latest_bundle(self, company_pk):
+        bundle_dir = f'{EXPORT_BUNDLE_DIR}/{company_pk}'
+        if not self.storage.exists(bundle_dir):
+            return None
+        names = [f'{bundle_dir}/{filename}' for filename in self.storage.listdir(bundle_dir)[1]
+                 if filename.endswith('.zip')]
+        return max(names, key=self.storage.get_modified_time, default=None)
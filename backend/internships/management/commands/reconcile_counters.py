@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from internships.counters import update_internship_counters, update_company_counters
+from internships.directory import invalidate_company_directory
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized applicant, internship and capacity counters of all companies and offers."
+
+    def handle(self, *args, **options):
+        update_internship_counters()
+        update_company_counters()
+        invalidate_company_directory()
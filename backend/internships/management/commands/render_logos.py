@@ -0,0 +1,47 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from internships.models import Company
+from internships.renditions import render_logo, logo_rendered
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Render the company logo sizes (in every format) that are not ready yet. " \
+           "Replaces running generateimages on every boot."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help="Check every company logo, not only the ones with pending sizes.")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep running and render the pending sizes every INTERVAL seconds, e.g. the ones "
+                                 "whose background rendition was lost to a restart, instead of rendering once.")
+
+    def handle(self, *args, **options):
+        if not options['interval']:
+            self.render(options)
+            return
+
+        while True:
+            try:
+                self.render(options)
+            except Exception:
+                logger.exception("rendering the company logos failed, retrying in %d seconds", options['interval'])
+
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def render(self, options):
+        companies = Company._base_manager.exclude(logo='').exclude(logo__isnull=True).only('id', 'logo', 'logo_metadata')
+        for company in companies.iterator():
+            if not options['all'] and not company.has_pending_logo_sizes:
+                continue
+
+            rendered = render_logo(company.pk, company.logo.name)
+            logo_rendered(company.pk, company.logo.name, rendered)
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{company}: {len(rendered)} logo sizes")
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('internships', '0011_auto_20220607_1738'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='logo_metadata',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='URL and width of every logo size, refreshed when the logo changes'),
+        ),
+    ]
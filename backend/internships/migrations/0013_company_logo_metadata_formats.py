@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('internships', '0012_company_logo_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='company',
+            name='logo_metadata',
+            field=models.JSONField(blank=True, default=list, editable=False, help_text='URL, width and format of every logo size, refreshed when the logo changes'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:48
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(queryset, group_by, aggregate):
+    queryset = queryset.order_by().values(group_by).annotate(value=aggregate).values('value')
+    return Coalesce(Subquery(queryset, output_field=IntegerField()), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Company = apps.get_model('internships', 'Company')
+    InternshipOffer = apps.get_model('internships', 'InternshipOffer')
+    StudentProfile = apps.get_model('students', 'StudentProfile')
+    Application = StudentProfile._meta.get_field('applications').remote_field.through
+
+    InternshipOffer.objects.update(applicant_count=count_subquery(
+        Application.objects.filter(internshipoffer=OuterRef('pk')), 'internshipoffer', Count('pk')))
+
+    offers = InternshipOffer.objects.filter(company=OuterRef('pk'))
+    Company.objects.update(
+        num_internships=count_subquery(offers, 'company', Count('pk')),
+        total_capacity=count_subquery(offers, 'company', Sum('capacity')),
+        applicant_count=count_subquery(Application.objects.filter(internshipoffer__company=OuterRef('pk')),
+                                       'internshipoffer__company', Count('studentprofile', distinct=True)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('internships', '0013_company_logo_metadata_formats'),
+        ('students', '0009_auto_20220606_1828'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='applicant_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='num_internships',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='total_capacity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='internshipoffer',
+            name='applicant_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,15 @@
 import uuid
-from operator import itemgetter
 
 from ckeditor_uploader.fields import RichTextUploadingField
 from django.contrib.auth.models import Group
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models.functions import Coalesce
 from django.urls import reverse
+from django.utils.functional import cached_property
 from django.utils.translation import ugettext as _
 from imagekit.cachefiles import ImageCacheFile
 from imagekit.models import ImageSpecField
+from PIL import Image
 from pilkit.processors import ResizeToFit
 
 from internships.tokens import default_export_token_generator
@@ -26,22 +26,47 @@ class CompanyContact(models.Model):
         return f"{self.email} <{self.phone}>"
 
 
-class CompanyManager(models.Manager):
-    def get_queryset(self):
-        return models.QuerySet(self.model) \
-            .annotate(total_capacity=Coalesce(models.Sum('internships__capacity'), 0)) \
-            .annotate(num_internships=models.Count('internships'))
+def get_supported_formats(*formats):
+    """
+    Return the image formats from ``formats`` that the installed Pillow can encode.
+    """
+    Image.init()
+    return tuple(image_format for image_format in formats if image_format.upper() in Image.SAVE)
+
+
+LOGO_DEFAULT_FORMAT = 'png'
+# AVIF encoding depends on how Pillow was built, so the variants are only generated where it is available
+LOGO_VARIANT_FORMATS = get_supported_formats('webp', 'avif')
+LOGO_FORMAT_OPTIONS = {
+    'webp': {'quality': 80},
+    'avif': {'quality': 60},
+}
 
 
 class CompanyLogoField(ImageSpecField):
-    def __init__(self, source, size, **kwargs):
+    def __init__(self, source, size, format=LOGO_DEFAULT_FORMAT, variant_formats=LOGO_VARIANT_FORMATS, **kwargs):
+        # the image is always padded to exactly size x 0.7*size, so the width is known without rendering it
+        self.size = size
+        self.image_format = format
+        self.variant_formats = variant_formats
         resizer = ResizeToFit(size, int(size * 0.7), upscale=True, mat_color=(0, 0, 0, 0))
-        super().__init__(source=source, processors=[resizer], format='png', **kwargs)
+        super().__init__(source=source, processors=[resizer], format=format,
+                         options=LOGO_FORMAT_OPTIONS.get(format), **kwargs)
 
+    def contribute_to_class(self, cls, name):
+        super().contribute_to_class(cls, name)
+        # register the logo variants once per class instead of looking them up on every instance
+        if 'logo_specs' not in cls.__dict__:
+            cls.logo_specs = []
+        cls.logo_specs.append((name, self))
 
-class Company(CreatedModifiedMixin):
-    objects = CompanyManager()
+        # the same size in every other format, e.g. logo_300w_webp next to logo_300w
+        for image_format in self.variant_formats:
+            variant = CompanyLogoField(source=self.source, size=self.size, format=image_format, variant_formats=())
+            variant.contribute_to_class(cls, f'{name}_{image_format}')
 
+
+class Company(CreatedModifiedMixin):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
     slug = models.SlugField(
@@ -58,24 +83,122 @@ class Company(CreatedModifiedMixin):
     logo = models.ImageField(null=True, blank=True, upload_to='logos', help_text=_(
         "The company's logo in as high a resolution as possible. The display aspect ratio is 10:7."))
     group = models.OneToOneField(Group, null=True, blank=True, on_delete=models.DO_NOTHING)
+    # denormalized, kept up to date by internships.signals (see internships.counters)
+    num_internships = models.PositiveIntegerField(default=0, editable=False)
+    total_capacity = models.PositiveIntegerField(default=0, editable=False)
+    applicant_count = models.PositiveIntegerField(default=0, editable=False)
+
+    logo_metadata = models.JSONField(default=list, blank=True, editable=False,
+                                     help_text=_("URL, width and format of every logo size, "
+                                                 "refreshed when the logo changes"))
 
     logo_32h = CompanyLogoField(source='logo', size=46)
     logo_300w = CompanyLogoField(source='logo', size=300)
     logo_500w = CompanyLogoField(source='logo', size=500)
     logo_1000w = CompanyLogoField(source='logo', size=1000)
 
+    def get_logo_files(self, image_format=None):
+        """
+        Return ``(spec field, ImageCacheFile)`` pairs for every logo size, without touching the storage.
+        If ``image_format`` is given, only the sizes in that format are returned.
+        """
+        if not self.logo:
+            return []
+        return [(field, ImageCacheFile(field.get_spec(source=self.logo))) for _, field in self.logo_specs
+                if image_format is None or field.image_format == image_format]
+
+    def get_logo_metadata(self, rendered=None):
+        """
+        Compute the URL, width and format of every logo size. ``rendered`` maps the URLs of the sizes
+        that are known to exist to their file size in bytes; if it is ``None``, the PNG sizes are assumed
+        to be rendered (as ``generateimages`` used to do) and the other formats are not.
+        """
+        metadata = []
+        for field, file in self.get_logo_files():
+            url = file.storage.url(file.name)
+            if rendered is None:
+                ready, file_size = field.image_format == LOGO_DEFAULT_FORMAT, None
+            else:
+                ready, file_size = url in rendered, rendered.get(url)
+            metadata.append({'url': url, 'width': field.size, 'format': field.image_format,
+                             'file_size': file_size, 'ready': ready})
+        return sorted(metadata, key=lambda size: size['width'], reverse=True)
+
+    def get_rendered_logo_sizes(self):
+        """
+        Map the URL of every logo size marked as ready in ``logo_metadata`` to its file size in bytes.
+        """
+        return {size['url']: size.get('file_size') for size in self.logo_metadata if size.get('ready', True)}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered to tell rows saved before the metadata column existed from companies whose logo changed
+        instance._loaded_logo_name = instance.__dict__.get('logo')
+        return instance
+
+    def refresh_logo_metadata(self):
+        """
+        Recompute ``logo_metadata`` if the logo changed. The new sizes are marked as not ready
+        until they are rendered in the background (see ``internships.renditions``).
+        """
+        if not self.logo_metadata and self.logo and self.logo.name == getattr(self, '_loaded_logo_name', None):
+            # a row saved before the metadata column existed, whose PNG sizes generateimages already rendered
+            metadata = self.get_logo_metadata()
+        else:
+            metadata = self.get_logo_metadata(rendered={})
+        if [size['url'] for size in metadata] != [size['url'] for size in self.logo_metadata]:
+            self.logo_metadata = metadata
+            self.__dict__.pop('logo_sizes', None)
+            # picked up by internships.signals, which schedules the renditions
+            self._logo_metadata_changed = True
+
     @property
+    def has_pending_logo_sizes(self):
+        rendered = self.get_rendered_logo_sizes()
+        return any(size['url'] not in rendered for size in self.get_logo_metadata(rendered={}))
+
+    @cached_property
     def logo_sizes(self):
-        result = []
+        """
+        URL, width, format and file size of every logo size, largest first.
+
+        PNG sizes that are still being rendered point to the largest PNG size that is ready, or to the
+        original logo if none is; sizes in the other formats are left out until they are rendered.
+        """
         if not self.logo:
-            return result
-        for field in dir(self):
-            if field.startswith('logo_') and field != 'logo_sizes':
-                spec = getattr(self, field, None)
-                if isinstance(spec, ImageCacheFile):
-                    result.append({'url': spec.url, 'width': spec.width})
+            return []
+        # rows saved before the metadata column existed fall back to computing it, which is also storage-free
+        metadata = self.logo_metadata or self.get_logo_metadata()
+        ready = [size for size in metadata if size.get('ready', True)]
+        placeholder = next((size for size in ready if size.get('format', LOGO_DEFAULT_FORMAT) == LOGO_DEFAULT_FORMAT),
+                           None)
+
+        sizes = []
+        for size in metadata:
+            image_format = size.get('format', LOGO_DEFAULT_FORMAT)
+            if size.get('ready', True):
+                sizes.append({'url': size['url'], 'width': size['width'], 'format': image_format,
+                              'file_size': size.get('file_size')})
+            elif image_format == LOGO_DEFAULT_FORMAT:
+                sizes.append({'url': placeholder['url'] if placeholder else self.logo.url, 'width': size['width'],
+                              'format': image_format, 'file_size': None})
+        return sizes
+
+    def save(self, *args, **kwargs):
+        if self.logo and not self.logo._committed:
+            # store the upload first (as FileField.pre_save would), since the logo size names depend on its final name
+            self.logo.save(self.logo.name, self.logo.file, save=False)
+        self.refresh_logo_metadata()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'logo' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'logo_metadata'}
+        super().save(*args, **kwargs)
+        self._loaded_logo_name = self.logo.name
 
-        return sorted(result, key=itemgetter('width'), reverse=True)
+    @property
+    def fill_ratio(self):
+        return self.applicant_count / self.total_capacity if self.total_capacity else 0.0
 
     @property
     def applicants_export_url(self):
@@ -127,6 +250,20 @@ class InternshipOffer(CreatedModifiedMixin):
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='internships')
     tags = models.ManyToManyField(InternshipTag, null=True, blank=True, related_name="internship_offer")
 
+    # denormalized, kept up to date by internships.signals (see internships.counters)
+    applicant_count = models.PositiveIntegerField(default=0, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so the counters of the previous company are updated too when an offer is moved
+        instance._loaded_company_id = instance.__dict__.get('company_id')
+        return instance
+
+    @property
+    def fill_ratio(self):
+        return self.applicant_count / self.capacity if self.capacity else 0.0
+
     def __str__(self):
         return self.title
 
@@ -0,0 +1,65 @@
+from functools import partial
+
+from django.db import transaction
+
+from internships.directory import invalidate_company_directory
+from internships.models import Company, LOGO_DEFAULT_FORMAT, LOGO_VARIANT_FORMATS
+from util.background import run_in_background
+
+
+def render_logo(company_pk, logo_name, image_format=None):
+    """
+    Render the logo sizes of a company, optionally only the ones in ``image_format``, and map the URL of
+    every rendered file to its size in bytes. Runs in a background worker and only touches the storage,
+    never the database.
+    """
+    company = Company(pk=company_pk, logo=logo_name)
+    rendered = {}
+    for _, file in company.get_logo_files(image_format):
+        file.generate()
+        rendered[file.storage.url(file.name)] = file.storage.size(file.name)
+    return rendered
+
+
+def logo_rendered(company_pk, logo_name, rendered):
+    """
+    Mark the rendered logo sizes as ready, unless the company's logo changed in the meantime.
+    """
+    with transaction.atomic():
+        # the formats are rendered by separate workers, whose results must not overwrite each other
+        company = Company._base_manager.select_for_update() \
+            .filter(pk=company_pk, logo=logo_name) \
+            .only('id', 'logo', 'logo_metadata') \
+            .first()
+        if company is None:
+            return
+
+        metadata = company.get_logo_metadata(rendered={**company.get_rendered_logo_sizes(), **rendered})
+        Company._base_manager.filter(pk=company_pk).update(logo_metadata=metadata)
+
+    # queryset updates don't send post_save
+    invalidate_company_directory()
+
+
+def schedule_logo_renditions(company):
+    """
+    Render the logo sizes of ``company`` that are not ready yet in the background, once the current
+    transaction commits. Every format is encoded by its own worker. Until they finish, the API serves
+    the sizes that are ready (see ``Company.logo_sizes``).
+    """
+    if not company.logo:
+        return
+
+    company_pk, logo_name = company.pk, company.logo.name
+    rendered = company.get_rendered_logo_sizes()
+    # e.g. only the variants of a logo whose PNG sizes generateimages rendered
+    image_formats = [image_format for image_format in (LOGO_DEFAULT_FORMAT, *LOGO_VARIANT_FORMATS)
+                     if any(file.storage.url(file.name) not in rendered
+                            for _, file in company.get_logo_files(image_format))]
+
+    def schedule():
+        for image_format in image_formats:
+            run_in_background(render_logo, company_pk, logo_name, image_format,
+                              callback=partial(logo_rendered, company_pk, logo_name))
+
+    transaction.on_commit(schedule)
@@ -1,5 +1,3 @@
-import random
-
 import django_filters
 import graphene
 from graphene import relay
@@ -7,7 +5,11 @@ from graphene_django import DjangoObjectType
 from graphene_django.filter import DjangoFilterConnectionField
 from rest_framework.relations import PrimaryKeyRelatedField
 
-from internships.models import Company, InternshipOffer, CompanyContact, InternshipTag
+from internships.directory import get_company_directory, CompanySequence
+from internships.models import Company, InternshipOffer, CompanyContact, InternshipTag, FacultyTag, LOGO_DEFAULT_FORMAT
+from util.loaders import load_related
+from util.optimizer import optimize_queryset
+from util.schema import BatchedFilterConnectionField
 
 
 class InternshipNode(DjangoObjectType):
@@ -16,6 +18,22 @@ class InternshipNode(DjangoObjectType):
         interfaces = (relay.Node,)
         exclude_fields = ('applicants',)
 
+    fill_ratio = graphene.Float(required=True, description="Number of applicants per available position.")
+
+    optimizer_hints = {
+        'fill_ratio': ('applicant_count', 'capacity'),
+    }
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
+    def resolve_tags(self, info, **kwargs):
+        return load_related(info, self, 'tags')
+
+    def resolve_target_group(self, info):
+        return load_related(info, self, 'target_group')
+
 
 
 class InternshipTagNode(DjangoObjectType):
@@ -24,6 +42,13 @@ class InternshipTagNode(DjangoObjectType):
         interfaces = (relay.Node,)
 
 
+class FacultyTagNode(DjangoObjectType):
+    class Meta:
+        model = FacultyTag
+        interfaces = (relay.Node,)
+        only_fields = ('id', 'name', 'code')
+
+
 class CompanyContactNode(DjangoObjectType):
     class Meta:
         model = CompanyContact
@@ -40,10 +65,12 @@ class InternshipFilterSet(django_filters.FilterSet):
 class ImageKitSpec(graphene.ObjectType):
     width = graphene.Int(required=True, description="Image width in pixels.")
     url = graphene.String(required=True, description="Absolute url path to image file.")
+    format = graphene.String(required=True, description="Image format, e.g. png, webp or avif.")
+    file_size = graphene.Int(description="Image file size in bytes, if known.")
 
 
 class CompanyNode(DjangoObjectType):
-    internships = DjangoFilterConnectionField(InternshipNode, filterset_class=InternshipFilterSet)
+    internships = BatchedFilterConnectionField(InternshipNode, filterset_class=InternshipFilterSet)
     total_capacity = graphene.Int(source='total_capacity', required=True)
     num_internships = graphene.Int(source='num_internships', required=True)
     exclude_fields = ('group','visible_for_students')
@@ -51,11 +78,33 @@ class CompanyNode(DjangoObjectType):
 
     logo = graphene.List(graphene.NonNull(ImageKitSpec), required=True,
                          description="A list of sizes available for the logo image. "
-                                     "The list is sorted in descending order of image width.")
+                                     "The list is sorted in descending order of image width.",
+                         formats=graphene.List(graphene.NonNull(graphene.String), default_value=['png'],
+                                               description="Image formats to include, e.g. [\"avif\", \"webp\", "
+                                                           "\"png\"] to build a <picture> element."))
+
+    fill_ratio = graphene.Float(required=True, description="Number of applicants per available position.")
+
+    optimizer_hints = {
+        'logo': ('logo', 'logo_metadata'),
+        'fill_ratio': ('applicant_count', 'total_capacity'),
+    }
 
-    def resolve_logo(self, info):
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
+    def resolve_logo(self, info, formats=None):
         company = self  # type: Company
-        return [ImageKitSpec(**sz) for sz in company.logo_sizes]
+        # an explicit null means the default, like an omitted argument
+        formats = [LOGO_DEFAULT_FORMAT] if formats is None else formats
+        return [ImageKitSpec(**sz) for sz in company.logo_sizes if sz['format'] in formats]
+
+    def resolve_internships(self, info, **kwargs):
+        return load_related(info, self, 'internships')
+
+    def resolve_contacts(self, info, **kwargs):
+        return load_related(info, self, 'contacts')
 
     class Meta:
         model = Company
@@ -64,12 +113,18 @@ class CompanyNode(DjangoObjectType):
 
 class CompanyFilterSet(django_filters.FilterSet):
     has_internships = django_filters.BooleanFilter(method='_has_internships')
+    seed = django_filters.CharFilter(method='_seed', help_text="Seed for the random order of the companies. "
+                                                              "Requests with the same seed get the same order, "
+                                                              "so pagination cursors stay valid between them.")
 
     @property
     def qs(self):
-        result = list(super().qs.filter(visible_for_students=True))
-        random.shuffle(result)
-        return result
+        # served from the cached company directory instead of the (aggregating) queryset;
+        # only the companies on the requested page are loaded
+        directory = get_company_directory()
+        ids = directory.get_ids(has_internships=bool(self.form.cleaned_data.get('has_internships')),
+                                seed=self.form.cleaned_data.get('seed') or None)
+        return CompanySequence(directory, ids)
 
     class Meta:
         model = Company
@@ -82,6 +137,10 @@ class CompanyFilterSet(django_filters.FilterSet):
         return queryset \
             .filter(visible_for_students=True,**filter_args)
 
+    def _seed(self, queryset, name, value):
+        # the ordering is applied in qs
+        return queryset
+
 
 class Query(object):
     company = relay.Node.Field(CompanyNode)
@@ -92,6 +151,6 @@ class Query(object):
 
     def resolve_company_by_slug(self, info, *, slug):
         try:
-            return Company.objects.get(slug=slug,visible_for_students=True)
+            return CompanyNode.get_queryset(Company.objects, info).get(slug=slug,visible_for_students=True)
         except Company.DoesNotExist:
             return None
@@ -0,0 +1,94 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+from internships.counters import update_company_counters, update_application_counters, update_internship_counters
+from internships.directory import invalidate_company_directory
+from internships.exports import schedule_company_exports
+from internships.models import Company, InternshipOffer, CompanyContact
+from internships.renditions import schedule_logo_renditions
+from students.models import StudentProfile
+from users.models import User
+
+
+@receiver(post_save, sender=InternshipOffer)
+@receiver(post_delete, sender=InternshipOffer)
+def internship_changed(sender, instance, **kwargs):
+    # an offer moved to another company changes the counters of both
+    company_ids = {instance.company_id, getattr(instance, '_loaded_company_id', None)} - {None}
+    update_company_counters(company_ids)
+    instance._loaded_company_id = instance.company_id
+
+
+@receiver(post_save, sender=InternshipOffer)
+def internship_saved(sender, instance, **kwargs):
+    # a regular save writes back the counter loaded with the offer, which may be stale by now
+    update_internship_counters([instance.pk])
+
+
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, **kwargs):
+    # same as for offers, e.g. an admin edit that took a while, or a reverted version
+    update_company_counters([instance.pk])
+
+
+@receiver(post_save, sender=Company)
+def company_logo_saved(sender, instance, **kwargs):
+    # whatever set the logo (the admin, the shell, a script), its new sizes have to be rendered
+    if instance.__dict__.pop('_logo_metadata_changed', False):
+        schedule_logo_renditions(instance)
+
+
+@receiver(m2m_changed, sender=StudentProfile.applications.through)
+def applications_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # with reverse=True, instance is the offer and pk_set holds student profile ids
+    if action == 'pre_clear':
+        instance._cleared_internship_ids = \
+            [instance.pk] if reverse else list(instance.applications.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        applications_updated(instance.__dict__.pop('_cleared_internship_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        applications_updated([instance.pk] if reverse else pk_set)
+
+
+@receiver(pre_delete, sender=StudentProfile)
+def student_profile_deleting(sender, instance, **kwargs):
+    # the applications are deleted by the cascade, which doesn't send m2m_changed
+    instance._deleted_internship_ids = list(instance.applications.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=StudentProfile)
+def student_profile_deleted(sender, instance, **kwargs):
+    applications_updated(instance.__dict__.pop('_deleted_internship_ids', []))
+
+
+@receiver(post_save, sender=StudentProfile)
+def student_profile_saved(sender, instance, created, **kwargs):
+    # the profile (e.g. its CV) is part of the export bundles of the companies the student applied to
+    if not created:
+        schedule_company_exports(set(instance.applications.values_list('company_id', flat=True)))
+
+
+@receiver(post_save, sender=User)
+def student_user_saved(sender, instance, created, update_fields, **kwargs):
+    # the name and e-mail are exported as well, and the export key only follows the profiles (e.g. not logins)
+    if created or (update_fields is not None and not {'first_name', 'last_name', 'email'} & set(update_fields)):
+        return
+    if StudentProfile.objects.filter(user=instance).update(modified_date=timezone.now()):
+        applications = StudentProfile.applications.through.objects.filter(studentprofile__user=instance)
+        schedule_company_exports(set(applications.values_list('internshipoffer__company_id', flat=True)))
+
+
+def applications_updated(internship_ids):
+    company_ids = update_application_counters(internship_ids)
+    schedule_company_exports(company_ids)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=InternshipOffer)
+@receiver(post_delete, sender=InternshipOffer)
+@receiver(post_save, sender=CompanyContact)
+@receiver(post_delete, sender=CompanyContact)
+def company_directory_changed(sender, **kwargs):
+    invalidate_company_directory()
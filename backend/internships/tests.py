@@ -1,3 +1,709 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from private_storage.storage import private_storage
+
+from internships.directory import CompanySequence, get_company_directory
+from internships.exports import ApplicantsExport, BulkExport, EXPORT_BUNDLE_GRACE_PERIOD, schedule_company_exports
+from internships.models import Company, InternshipOffer, CompanyContact, InternshipTag, FacultyTag
+from internships.renditions import render_logo, schedule_logo_renditions
+from internships.schema import CompanyNode
+from internships.tokens import default_export_token_generator
+from students.models import StudentProfile
+from users.models import User, StudentClass
+from util.background import run_in_background
+
+
+class CompanyDirectoryQueryTestCase(TestCase):
+    query = '''
+    {
+      companies {
+        edges {
+          node {
+            name
+            internships { edges { node { title targetGroup { name } tags { edges { node { name } } } } } }
+            contacts { edges { node { email } } }
+          }
+        }
+      }
+    }
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        self.tags = [InternshipTag.objects.create(name=name) for name in ('python', 'java')]
+
+    def create_companies(self, count):
+        start = Company.objects.count()
+        for i in range(start, start + count):
+            company = Company.objects.create(name=f'Company {i}', slug=f'company-{i}', description='-',
+                                             visible_for_students=True)
+            CompanyContact.objects.create(company=company, email=f'hr@company-{i}.ro')
+            for j in range(2):
+                offer = InternshipOffer.objects.create(company=company, title=f'Offer {j}', is_paid=True,
+                                                       capacity=2, target_group=self.faculty)
+                offer.tags.set(self.tags)
+        cache.clear()
+
+    def run_query(self):
+        response = self.client.post('/graphql', {'query': self.query}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertNotIn('errors', result)
+        return result['data']['companies']['edges']
+
+    def test_nested_relations_are_batched(self):
+        # directory, internships, target groups, tags, contacts
+        self.create_companies(2)
+        with self.assertNumQueries(5):
+            self.assertEqual(len(self.run_query()), 2)
+
+        self.create_companies(4)
+        with self.assertNumQueries(5):
+            edges = self.run_query()
+
+        self.assertEqual(len(edges), 6)
+        for edge in edges:
+            internships = edge['node']['internships']['edges']
+            self.assertEqual(len(internships), 2)
+            self.assertEqual(internships[0]['node']['targetGroup']['name'], 'Calculatoare')
+            self.assertEqual(len(internships[0]['node']['tags']['edges']), 2)
+            self.assertEqual(len(edge['node']['contacts']['edges']), 1)
+
+
+class CompanyDirectoryTestCase(TestCase):
+    query = '''
+    query Companies($seed: String, $after: String) {
+      companies(seed: $seed, first: 3, after: $after) {
+        edges { node { slug } }
+        pageInfo { endCursor }
+      }
+    }
+    '''
+
+    def setUp(self):
+        cache.clear()
+        self.companies = [Company.objects.create(name=f'Company {i}', slug=f'company-{i}', description='-',
+                                                 visible_for_students=True) for i in range(8)]
+        self.slugs = {company.pk: company.slug for company in self.companies}
+
+    def get_page(self, seed, after=None):
+        response = self.client.post('/graphql', {'query': self.query, 'variables': {'seed': seed, 'after': after}},
+                                    content_type='application/json')
+        result = response.json()
+        self.assertNotIn('errors', result)
+        companies = result['data']['companies']
+        return [edge['node']['slug'] for edge in companies['edges']], companies['pageInfo']['endCursor']
+
+    def test_seed_determines_the_order(self):
+        directory = get_company_directory()
+        ids = directory.get_ids(seed='a')
+        self.assertEqual(sorted(ids), sorted(self.slugs))
+        self.assertEqual(directory.get_ids(seed='a'), ids)
+        self.assertNotEqual(directory.get_ids(seed='b'), ids)
+
+        first_page, cursor = self.get_page('a')
+        self.assertEqual(first_page, [self.slugs[pk] for pk in ids[:3]])
+        self.assertEqual(self.get_page('a')[0], first_page)
+        self.assertEqual(self.get_page('a', after=cursor)[0], [self.slugs[pk] for pk in ids[3:6]])
+        self.assertEqual(self.get_page('b')[0], [self.slugs[pk] for pk in directory.get_ids(seed='b')[:3]])
+
+    def test_slicing_only_loads_the_page(self):
+        directory = get_company_directory()
+        ids = directory.get_ids(seed='a')
+        keys = [directory.get_company_key(pk) for pk in ids]
+        cache.delete_many(keys)
+
+        companies = CompanySequence(directory, ids)[2:4]
+        self.assertEqual(len(companies), 2)
+        with self.assertNumQueries(1):
+            self.assertEqual([company.pk for company in companies], ids[2:4])
+        self.assertEqual(list(cache.get_many(keys)), keys[2:4])
+
+        # cached now
+        with self.assertNumQueries(0):
+            self.assertEqual([company.pk for company in companies], ids[2:4])
+
+    def test_directory_is_invalidated_on_save(self):
+        directory = get_company_directory()
+        company = self.companies[0]
+        company.name = 'Renamed'
+        company.save()
+        self.assertEqual(get_company_directory().get_companies([company.pk])[0].name, 'Renamed')
+
+        hidden = Company.objects.create(name='Hidden', slug='hidden', description='-')
+        self.assertNotIn(hidden.pk, get_company_directory().ids)
+        hidden.visible_for_students = True
+        hidden.save()
+        self.assertIn(hidden.pk, get_company_directory().ids)
+        self.assertNotEqual(get_company_directory().version, directory.version)
+
+
+class CompanyQueryOptimizerTestCase(TestCase):
+    query = '''
+    query Company($slug: String!) {
+      companyBySlug(slug: $slug) {
+        name
+        internships { edges { node { title tags { edges { node { name } } } } } }
+      }
+    }
+    '''
+
+    def setUp(self):
+        self.faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        self.company = Company.objects.create(name='Company', slug='company', description='Secret description',
+                                              visible_for_students=True)
+
+    def add_internships(self, count):
+        start = InternshipOffer.objects.count()
+        for i in range(start, start + count):
+            offer = InternshipOffer.objects.create(company=self.company, title=f'Offer {i}', is_paid=True,
+                                                   capacity=2, target_group=self.faculty)
+            offer.tags.set([InternshipTag.objects.create(name=f'tag {i}.{j}') for j in range(2)])
+
+    def run_query(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/graphql', {'query': query, 'variables': {'slug': 'company'}},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertNotIn('errors', result)
+        return result['data']['companyBySlug'], [query['sql'] for query in queries]
+
+    def test_nested_relations_are_prefetched(self):
+        # the company, its internships, their tags
+        self.add_internships(1)
+        _, queries = self.run_query(self.query)
+        self.assertEqual(len(queries), 3)
+
+        self.add_internships(3)
+        company, queries = self.run_query(self.query)
+        self.assertEqual(len(queries), 3)
+        internships = company['internships']['edges']
+        self.assertEqual(len(internships), 4)
+        self.assertTrue(all(len(edge['node']['tags']['edges']) == 2 for edge in internships))
+
+    def test_unselected_columns_are_deferred(self):
+        self.add_internships(1)
+        _, queries = self.run_query(self.query)
+        self.assertNotIn('"description"', queries[0])
+        self.assertNotIn('"requirements"', queries[1])
+
+        _, queries = self.run_query(self.query.replace('name\n', 'name description\n', 1))
+        self.assertIn('"description"', queries[0])
+
+
+class ApplicantsExportQueryTestCase(TestCase):
+    def setUp(self):
+        self.study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        self.company = Company.objects.create(name='Company', slug='company', description='-',
+                                              visible_for_students=True)
+        faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        self.offers = [InternshipOffer.objects.create(company=self.company, title=f'Offer {i}', is_paid=True,
+                                                      capacity=2, target_group=faculty) for i in range(2)]
+
+    def create_applicants(self, count):
+        start = StudentProfile.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(email=f'student{i}@stud.acs.upb.ro', username=f'student{i}',
+                                       first_name='Ana', last_name=f'Student {i}')
+            StudentProfile.objects.create(user=user, study_class=self.study_class).applications.set(self.offers)
+
+    def export(self):
+        export = ApplicantsExport(self.company)
+        export.get_key()
+        csv_file, xlsx_file, _ = export.write_tables()
+        xlsx_file.close()
+        csv_file.seek(0)
+        with io.TextIOWrapper(csv_file, encoding='utf-8', newline='') as f:
+            return list(csv.reader(f))
+
+    def test_applicants_are_loaded_once(self):
+        # the key, and the applicants
+        self.create_applicants(2)
+        with self.assertNumQueries(2):
+            self.assertEqual(len(self.export()), 3)
+
+        self.create_applicants(4)
+        with self.assertNumQueries(2):
+            rows = self.export()
+
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[0][1:4], ['class', 'last_name', 'first_name'])
+        self.assertEqual(sorted(row[2] for row in rows[1:]), [f'Student {i}' for i in range(6)])
+        self.assertTrue(all(row[1] == '3 CTI' and row[3] == 'Ana' for row in rows[1:]))
+
+    def test_exported_content(self):
+        use_temporary_private_storage(self)
+        self.create_applicants(2)
+        profile = StudentProfile.objects.get(user__username='student0')
+        profile.phone = '+40712345678'
+        profile.linkedin = 'https://linkedin.com/in/student0'
+        profile.cv = SimpleUploadedFile('CV Ana.pdf', b'%PDF-1.4 cv', content_type='application/pdf')
+        profile.save()
+
+        rows = self.export()
+        exported = dict(zip(rows[0], next(row for row in rows[1:] if row[rows[0].index('id')] == str(profile.pk))))
+        cv_filename = f'cv/{os.path.splitext(os.path.basename(profile.cv.path))[0]}@{profile.pk}.pdf'
+        self.assertEqual({key: value for key, value in exported.items() if key != 'cv_url'}, {
+            'id': str(profile.pk), 'class': '3 CTI', 'last_name': 'Student 0', 'first_name': 'Ana',
+            'tel': '+40712345678', 'email': 'student0@stud.acs.upb.ro', 'cv_filename': cv_filename,
+            'linkedin': 'https://linkedin.com/in/student0', 'github': '',
+        })
+        self.assertTrue(exported['cv_url'].endswith(profile.cv_url))
+        other = next(row for row in rows[1:] if row[rows[0].index('id')] != str(profile.pk))
+        self.assertEqual(other[rows[0].index('cv_filename')], '')
+
+        z = ApplicantsExport(self.company).get_zip('now')
+        with zipfile.ZipFile(io.BytesIO(b''.join(z.blocks()))) as archive:
+            self.assertEqual(sorted(archive.namelist()), [cv_filename, 'date-studenti-now.csv', 'date-studenti-now.xlsx'])
+            self.assertEqual(archive.read(cv_filename), b'%PDF-1.4 cv')
+            self.assertEqual(list(csv.reader(io.StringIO(archive.read('date-studenti-now.csv').decode()))), rows)
+
+    def test_key_follows_applicants(self):
+        export = ApplicantsExport(self.company)
+        keys = [export.get_key()]
+        self.create_applicants(2)
+        keys.append(export.get_key())
+        self.assertEqual(export.get_key(), keys[-1])
+
+        profile = StudentProfile.objects.order_by('pk').first()
+        profile.applications.remove(self.offers[0])
+        keys.append(export.get_key())
+        profile.applications.add(self.offers[0])
+        keys.append(export.get_key())
+
+        profile.phone = '+40712345678'
+        profile.save()
+        keys.append(export.get_key())
+
+        user = profile.user
+        user.last_login = timezone.now()
+        user.save(update_fields=['last_login'])
+        self.assertEqual(export.get_key(), keys[-1])
+        user.last_name = 'Changed'
+        user.save()
+        keys.append(export.get_key())
+
+        self.assertEqual(len(set(keys)), len(keys))
+
+
+def use_temporary_private_storage(test_case):
+    storage_root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, storage_root, ignore_errors=True)
+    for attribute in ('location', 'base_location'):
+        patcher = mock.patch.object(private_storage, attribute, storage_root)
+        patcher.start()
+        test_case.addCleanup(patcher.stop)
+
+
+class ApplicantsExportViewTestCase(TestCase):
+    def setUp(self):
+        use_temporary_private_storage(self)
+        settings_override = override_settings(BACKGROUND_TASK_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        self.study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        self.company = Company.objects.create(name='Company', slug='company', description='-')
+        faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        self.offer = InternshipOffer.objects.create(company=self.company, title='Offer', is_paid=True, capacity=2,
+                                                    target_group=faculty)
+        self.url = reverse('export_company_applicants', kwargs={'pk': self.company.pk})
+        self.token = default_export_token_generator.make_token(self.company)
+
+    def create_applicant(self, i):
+        user = User.objects.create(email=f'student{i}@stud.acs.upb.ro', username=f'student{i}',
+                                   first_name='Ana', last_name=f'Student {i}')
+        StudentProfile.objects.create(user=user, study_class=self.study_class).applications.add(self.offer)
+
+    def get_bundles(self):
+        export = ApplicantsExport(self.company)
+        if not private_storage.exists(export.get_bundle_dir()):
+            return []
+        return sorted(private_storage.listdir(export.get_bundle_dir())[1])
+
+    def test_etag(self):
+        self.create_applicant(0)
+        self.assertEqual(self.client.get(self.url, {'token': 'invalid'}).status_code, 403)
+
+        response = self.client.get(self.url, {'token': self.token})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as z:
+            csv_name = next(name for name in z.namelist() if name.endswith('.csv'))
+            self.assertIn('Student 0', z.read(csv_name).decode())
+        self.assertEqual(len(self.get_bundles()), 1)
+
+        with mock.patch.object(ApplicantsExport, 'build_bundle') as build_bundle:
+            response = self.client.get(self.url, {'token': self.token}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        build_bundle.assert_not_called()
+
+        self.create_applicant(1)
+        response = self.client.get(self.url, {'token': self.token}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response.close()
+
+    def test_superseded_bundles_are_kept_for_a_while(self):
+        export = ApplicantsExport(self.company)
+        for key, age in (('a', 2 * EXPORT_BUNDLE_GRACE_PERIOD), ('b', EXPORT_BUNDLE_GRACE_PERIOD + 10)):
+            path = private_storage.path(export.get_bundle(key))
+            os.utime(path, (time.time() - age, time.time() - age))
+        self.assertEqual(self.get_bundles(), ['a.zip', 'b.zip'])
+
+        # b was superseded just now, a was superseded by b long ago
+        export.get_bundle('c')
+        self.assertEqual(self.get_bundles(), ['b.zip', 'c.zip'])
+
+        export.get_bundle('d')
+        self.assertEqual(self.get_bundles(), ['b.zip', 'c.zip', 'd.zip'])
+
+    def test_rebuilds_are_coalesced(self):
+        with mock.patch('internships.exports.run_in_background') as run_in_background:
+            for _ in range(3):
+                with self.captureOnCommitCallbacks(execute=True):
+                    schedule_company_exports({self.company.pk})
+            self.assertEqual(run_in_background.call_count, 1)
+
+            # once the rebuild starts, later changes need another one
+            func, company_pk = run_in_background.call_args.args
+            func(company_pk)
+            with self.captureOnCommitCallbacks(execute=True):
+                schedule_company_exports({self.company.pk})
+            self.assertEqual(run_in_background.call_count, 2)
+
+
+class BulkExportAdminTestCase(TestCase):
+    url = '/admin/internships/company/'
+
+    def setUp(self):
+        use_temporary_private_storage(self)
+        settings_override = override_settings(BACKGROUND_TASK_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        group = Group.objects.create(name='Company')
+        group.permissions.add(*Permission.objects.filter(codename__in=['view_company', 'change_company']))
+        self.companies = []
+        for i in range(2):
+            company = Company.objects.create(name=f'Company {i}', slug=f'company-{i}', description='-',
+                                             visible_for_students=True, group=None if i else group)
+            offer = InternshipOffer.objects.create(company=company, title='Offer', is_paid=True, capacity=2,
+                                                   target_group=faculty)
+            user = User.objects.create(email=f'student{i}@stud.acs.upb.ro', username=f'student{i}')
+            StudentProfile.objects.create(user=user, study_class=study_class).applications.add(offer)
+            self.companies.append(company)
+
+        self.superuser = User.objects.create(email='admin@ligaac.ro', username='admin', is_staff=True,
+                                             is_superuser=True)
+        self.staff = User.objects.create(email='hr@company.ro', username='hr', is_staff=True)
+        self.staff.groups.add(group)
+
+    def start_export(self):
+        return self.client.post(self.url, {'action': 'export_applicants_bulk_action', 'index': 0,
+                                           '_selected_action': [company.pk for company in self.companies]})
+
+    def test_action_is_only_for_superusers(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'export_applicants_bulk_action')
+
+        response = self.start_export()
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, self.url)
+
+        job = BulkExport.start(self.companies)
+        for view in ('internships_company_bulk_export', 'internships_company_bulk_export_download'):
+            self.assertEqual(self.client.get(reverse(f'admin:{view}', args=[job.job_id])).status_code, 403)
+
+        self.client.force_login(self.superuser)
+        self.assertContains(self.client.get(self.url), 'export_applicants_bulk_action')
+
+    def test_bulk_export(self):
+        self.client.force_login(self.superuser)
+        response = self.start_export()
+        self.assertEqual(response.status_code, 302)
+        job_id = response.url.rstrip('/').rsplit('/', 1)[-1]
+
+        response = self.client.get(response.url)
+        self.assertContains(response, 'Exported the applicants of 2 companies.')
+        self.assertContains(response, 'Download all')
+        for company in self.companies:
+            self.assertContains(response, company.applicants_export_url)
+
+        download_url = reverse('admin:internships_company_bulk_export_download', args=[job_id])
+        response = self.client.get(download_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response['Content-Disposition'])
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as z:
+            self.assertEqual(sorted(z.namelist()), ['company-0.zip', 'company-1.zip'])
+            with zipfile.ZipFile(io.BytesIO(z.read('company-0.zip'))) as bundle:
+                csv_name = next(name for name in bundle.namelist() if name.endswith('.csv'))
+                self.assertIn('student0@stud.acs.upb.ro', bundle.read(csv_name).decode())
+
+        # assembled once, and then served from the storage
+        with mock.patch.object(BulkExport, 'get_zip') as get_zip:
+            response = self.client.get(download_url)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+        get_zip.assert_not_called()
+
+        self.assertEqual(self.client.get(reverse('admin:internships_company_bulk_export', args=['missing']))
+                         .status_code, 404)
+
+    def test_download_waits_for_the_export(self):
+        self.client.force_login(self.superuser)
+        with mock.patch('internships.exports.run_in_background'):
+            job = BulkExport.start(self.companies)
+
+        response = self.client.get(reverse('admin:internships_company_bulk_export', args=[job.job_id]))
+        self.assertContains(response, 'in progress', count=2)
+        self.assertNotContains(response, 'Download all')
+
+        response = self.client.get(reverse('admin:internships_company_bulk_export_download', args=[job.job_id]))
+        self.assertRedirects(response, reverse('admin:internships_company_bulk_export', args=[job.job_id]))
+
+        job.item_done(self.companies[0].pk, (None, 'failed'))
+        response = self.client.get(reverse('admin:internships_company_bulk_export', args=[job.job_id]))
+        self.assertContains(response, 'failed (failed)')
+        self.assertContains(response, 'in progress', count=1)
+
+
+class CountersTestCase(TestCase):
+    def setUp(self):
+        study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        self.companies = [Company.objects.create(name=f'Company {i}', slug=f'company-{i}', description='-',
+                                                 visible_for_students=True) for i in range(2)]
+        self.offers = [InternshipOffer.objects.create(company=self.companies[i % 2], title=f'Offer {i}',
+                                                      is_paid=True, capacity=2, target_group=faculty)
+                       for i in range(3)]
+        self.profiles = []
+        for i in range(3):
+            user = User.objects.create(email=f'student{i}@stud.acs.upb.ro', username=f'student{i}')
+            self.profiles.append(StudentProfile.objects.create(user=user, study_class=study_class))
+
+    def get_counters(self):
+        companies = Company.objects.order_by('slug') \
+            .values_list('slug', 'num_internships', 'total_capacity', 'applicant_count')
+        offers = InternshipOffer.objects.order_by('title').values_list('title', 'applicant_count')
+        return list(companies), list(offers)
+
+    def assertCountersReconciled(self):
+        counters = self.get_counters()
+        call_command('reconcile_counters')
+        self.assertEqual(counters, self.get_counters())
+
+    def test_counters(self):
+        for profile in self.profiles:
+            profile.add_application(self.offers[0].pk)
+        self.profiles[0].add_application(self.offers[2].pk)
+        self.profiles[1].set_applications([self.offers[1].pk, self.offers[2].pk])
+        self.assertCountersReconciled()
+        self.assertEqual(self.get_counters(), (
+            [('company-0', 2, 4, 3), ('company-1', 1, 2, 1)],
+            [('Offer 0', 2), ('Offer 1', 1), ('Offer 2', 2)],
+        ))
+
+        self.profiles[0].remove_application(self.offers[0].pk)
+        self.offers[2].applicants.remove(self.profiles[1])
+        self.assertCountersReconciled()
+
+        # saved from a copy loaded before the applications changed
+        offer = self.offers[1]
+        offer.capacity = 5
+        offer.save()
+        self.assertCountersReconciled()
+        self.assertEqual(self.get_counters()[0][1], ('company-1', 1, 5, 1))
+
+        company = self.companies[0]
+        company.description = 'Changed'
+        company.save()
+        self.assertCountersReconciled()
+
+        offer = InternshipOffer.objects.get(pk=self.offers[2].pk)
+        offer.company = self.companies[1]
+        offer.save()
+        self.assertCountersReconciled()
+        self.assertEqual(self.get_counters()[0], [('company-0', 1, 2, 1), ('company-1', 2, 7, 2)])
+
+        self.offers[1].delete()
+        self.assertCountersReconciled()
+
+        self.profiles[2].delete()
+        self.assertCountersReconciled()
+        self.assertEqual(self.get_counters(), (
+            [('company-0', 1, 2, 0), ('company-1', 1, 2, 1)],
+            [('Offer 0', 0), ('Offer 2', 1)],
+        ))
+
+
+def make_logo(name='logo.png', size=(200, 100)):
+    image = io.BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(image, 'PNG')
+    return SimpleUploadedFile(name, image.getvalue(), content_type='image/png')
+
+
+class CompanyLogoTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, BACKGROUND_TASK_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+        self.company = Company.objects.create(name='Company', slug='company', description='-',
+                                              visible_for_students=True, logo=make_logo())
+
+    def query_logo(self, **variables):
+        query = '''
+        query ($formats: [String!]) {
+          companies { edges { node { logo(formats: $formats) { url width format } } } }
+        }
+        '''
+        response = self.client.post('/graphql', {'query': query, 'variables': variables},
+                                    content_type='application/json')
+        result = response.json()
+        self.assertNotIn('errors', result)
+        return result['data']['companies']['edges'][0]['node']['logo']
+
+    def test_logo_formats_null_means_default(self):
+        # graphql-core 2 has no null literal, but a variable can be null
+        sizes = self.query_logo(formats=None)
+        self.assertEqual(sizes, self.query_logo(formats=['png']))
+        self.assertEqual([size['width'] for size in sizes], [1000, 500, 300, 46])
+        self.assertTrue(all(size['format'] == 'png' for size in sizes))
+
+        resolved = CompanyNode.resolve_logo(self.company, None, formats=None)
+        self.assertEqual([size.url for size in resolved], [size['url'] for size in sizes])
+
+    def test_logo_metadata_follows_the_logo(self):
+        urls = [size['url'] for size in self.company.logo_metadata]
+        self.assertEqual(len(urls), len(self.company.get_logo_metadata()))
+        self.assertFalse(any(size['ready'] for size in self.company.logo_metadata))
+
+        # unrelated changes keep the metadata
+        company = Company.objects.get(pk=self.company.pk)
+        company.name = 'Renamed'
+        company.save()
+        self.assertEqual(Company.objects.get(pk=self.company.pk).logo_metadata, self.company.logo_metadata)
+
+        company.logo = make_logo('new.png', size=(300, 300))
+        company.save(update_fields=['logo'])
+        metadata = Company.objects.get(pk=self.company.pk).logo_metadata
+        self.assertEqual(len(metadata), len(urls))
+        self.assertTrue(set(size['url'] for size in metadata).isdisjoint(urls))
+        # none of the new sizes is rendered yet, so the original logo stands in for them
+        self.assertEqual({size['url'] for size in company.logo_sizes}, {company.logo.url})
+
+        company.logo = None
+        company.save()
+        self.assertEqual(Company.objects.get(pk=self.company.pk).logo_metadata, [])
+
+    def make_legacy(self):
+        # as migration 0012 left the companies that already had a logo
+        Company.objects.filter(pk=self.company.pk).update(logo_metadata=[])
+        return Company.objects.get(pk=self.company.pk)
+
+    def test_saving_a_legacy_company_keeps_its_png_sizes(self):
+        company = self.make_legacy()
+        company.name = 'Renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            company.save()
+
+        metadata = Company.objects.get(pk=self.company.pk).logo_metadata
+        self.assertEqual([size['ready'] for size in metadata], [size['format'] == 'png' for size in metadata])
+        png_sizes = [size for size in company.logo_sizes if size['format'] == 'png']
+        self.assertEqual([size['url'] for size in png_sizes],
+                         [size['url'] for size in metadata if size['format'] == 'png'])
+        self.assertNotIn(company.logo.url, [size['url'] for size in png_sizes])
+        # the other formats are rendered in the background
+        self.assertEqual(len(callbacks), 1)
+
+    def test_renditions_are_scheduled_whenever_the_logo_changes(self):
+        company = Company.objects.get(pk=self.company.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            company.description = 'Changed'
+            company.save()
+        self.assertFalse(Company.objects.get(pk=self.company.pk).get_rendered_logo_sizes())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            company.logo = make_logo('new.png', size=(300, 300))
+            company.save()
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertTrue(all(size['ready'] for size in company.logo_metadata))
+        self.assertFalse(company.has_pending_logo_sizes)
+
+    def test_legacy_company_gets_its_variant_sizes(self):
+        company = self.make_legacy()
+        self.assertEqual(self.query_logo(formats=['webp']), [])
+
+        with mock.patch('internships.renditions.render_logo', wraps=render_logo) as renders, \
+                self.captureOnCommitCallbacks(execute=True):
+            company.save()
+        # the PNG sizes were rendered by generateimages
+        self.assertEqual(sorted(c.args[2] for c in renders.call_args_list), ['avif', 'webp'])
+
+        sizes = self.query_logo(formats=['webp'])
+        self.assertEqual([size['width'] for size in sizes], [1000, 500, 300, 46])
+        for size in sizes:
+            self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, size['url'][len(settings.MEDIA_URL):])))
+        self.assertFalse(Company.objects.get(pk=self.company.pk).has_pending_logo_sizes)
+
+    def test_render_logos_loop_renders_pending_sizes(self):
+        class Stop(Exception):
+            pass
+
+        self.make_legacy()
+        sleeps = mock.Mock(side_effect=[None, Stop()])
+        with mock.patch('internships.management.commands.render_logos.time.sleep', sleeps):
+            with self.assertRaises(Stop):
+                call_command('render_logos', interval=3600)
+
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertTrue(company.logo_metadata)
+        self.assertFalse(company.has_pending_logo_sizes)
+        self.assertEqual(sleeps.call_count, 2)
+
+    def test_renditions_run_inline_without_workers(self):
+        callback = mock.Mock()
+        run_in_background(sum, [1, 2], callback=callback)
+        callback.assert_called_once_with(3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_logo_renditions(self.company)
+
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertTrue(all(size['ready'] and size['file_size'] for size in company.logo_metadata))
+        for size in company.logo_metadata:
+            path = os.path.join(settings.MEDIA_ROOT, size['url'][len(settings.MEDIA_URL):])
+            self.assertEqual(os.path.getsize(path), size['file_size'])
+        self.assertEqual([size['url'] for size in self.query_logo()],
+                         [size['url'] for size in company.logo_metadata if size['format'] == 'png'])
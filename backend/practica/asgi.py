@@ -0,0 +1,17 @@
+"""
+ASGI config for practica project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run with ``SERVER_MODE=asgi``, so ``/graphql`` is served by the async view.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "practica.settings")
+
+application = get_asgi_application()
@@ -63,6 +63,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'util.middleware.CurrentRequestMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -216,6 +217,11 @@ LOGGING = {
             'handlers': ['sql_log'],
             'propagate': False,
         },
+        'users.auth_service': {
+            'handlers': ['debug_log', 'console_log'],
+            'level': 'INFO',
+            'propagate': True,
+        },
     },
 }
 
@@ -260,6 +266,40 @@ PHONENUMBER_DEFAULT_REGION = 'RO'
 IMPORT_EXPORT_USE_TRANSACTIONS = True
 
 APPLICANT_EXPORT_TIMEOUT_DAYS = 60
+# seconds to wait before rebuilding a company's applicant export in the background, so that the changes
+# made in the meantime are included in the same rebuild
+EXPORT_REBUILD_DELAY = 60
+
+# the directory is invalidated whenever a company or one of its offers/contacts changes;
+# the timeout only bounds how long an unused snapshot stays in the cache
+COMPANY_DIRECTORY_CACHE_TIMEOUT = 60 * 60
+
+# size of the process pool for background work such as logo renditions; 0 runs it synchronously
+BACKGROUND_TASK_WORKERS = int(os.getenv('BACKGROUND_TASK_WORKERS', 2))
+
+# token -> user lookups are cached in the default cache, and for a few seconds in every process
+TOKEN_CACHE_TIMEOUT = 5 * 60
+TOKEN_LOCAL_CACHE_TIMEOUT = 10
+TOKEN_LOCAL_CACHE_SIZE = 1024
+
+# 'db' issues Token rows, 'signed' issues self-contained signed tokens (see users.tokens); both are accepted
+TOKEN_MODE = os.getenv('TOKEN_MODE', 'db')
+# logins within this many seconds of the previous one get the same token back instead of a new row
+TOKEN_REUSE_WINDOW = 60
+
+# 'asgi' when served by practica.asgi (see django-entrypoint.sh); GraphQL requests are then executed
+# in a pool of GRAPHQL_THREADS threads while the event loop keeps accepting requests
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+GRAPHQL_THREADS = int(os.getenv('GRAPHQL_THREADS', 32))
+
+# calls to the university auth service (see users.auth_service); timeouts are in seconds
+AUTH_SERVICE_CONNECT_TIMEOUT = 3
+AUTH_SERVICE_READ_TIMEOUT = 10
+AUTH_SERVICE_POOL_SIZE = 10
+AUTH_SERVICE_FAILURE_THRESHOLD = 5
+AUTH_SERVICE_RESET_TIMEOUT = 30
+# every worker logs its call counts and latencies this often, and whenever the circuit breaker opens or closes
+AUTH_SERVICE_STATS_INTERVAL = 300
 
 ADMIN_REORDER = (
     {
@@ -24,6 +24,7 @@ from graphene_django.views import GraphQLView
 
 from internships.views import ExportApplicantsView
 from students.views import StudentCVDownloadView, StudentCVUploadView
+from util.views import AsyncGraphQLView
 
 
 if getattr(settings, 'REVPROXY_FRONTEND_URL', ''):
@@ -39,6 +40,11 @@ else:
     def dummy_view(request, *args, **kwargs):
         raise NotImplementedError("This view should be routed to client-side code.")
 
+if settings.SERVER_MODE == 'asgi':
+    graphql_view = AsyncGraphQLView.as_view(graphiql=True)
+else:
+    graphql_view = csrf_exempt(GraphQLView.as_view(graphiql=True))
+
 
 urlpatterns = [
     path('admin/ckeditor/', include('ckeditor_uploader.urls')),
@@ -46,7 +52,7 @@ urlpatterns = [
     path('admin', RedirectView.as_view(url='/admin/')),
     path('accounts/', include('allauth.urls')),
 
-    path('graphql', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql', graphql_view),
     path('graphql/', RedirectView.as_view(url='/graphql')),
 
     path('private/cv/<uuid:pk>/<str:basename>', StudentCVDownloadView.as_view(), name='download_student_cv'),
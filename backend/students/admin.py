@@ -1,16 +1,17 @@
 from allauth.utils import build_absolute_uri
 from django.contrib import admin
 from django.contrib.admin import StackedInline
-from django.db.models import Q, Count
+from django.db.models import Count, Exists, OuterRef, Prefetch
 from django.urls import reverse
-from django.utils.html import escape, format_html
+from django.utils.html import escape, format_html, format_html_join
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext_lazy as _
 from import_export import resources
-from import_export.admin import ImportExportMixin, ExportActionModelAdmin
+from import_export.admin import ImportExportMixin, ExportActionModelAdmin, ExportMixin
 
+from internships.models import InternshipOffer
 from students.models import StudentProfile
-from util.admin import add_nested_filters
+from util.admin import add_nested_filters, get_staff_group_ids, StreamingExportMixin
 from django.http import HttpResponseForbidden
 
 
@@ -28,10 +29,7 @@ class ProfileCompletionListFilter(admin.SimpleListFilter):
         if self.value() not in ('0', '1'):
             return queryset
 
-        cv_q = (Q(cv__isnull=False) & ~Q(cv__exact='')) | (Q(linkedin__isnull=False) & ~Q(linkedin__exact=''))
-        app_q = Q(applications__isnull=False) & cv_q
-        fq = app_q
-        return queryset.filter(fq if self.value() == '1' else ~fq).distinct()
+        return queryset.filter(is_complete=self.value() == '1')
 
 
 class StudentListAdminMixin(object):
@@ -71,6 +69,43 @@ def add_resource_fields(fields):
     return decorator
 
 
+def get_visible_applications(group_ids):
+    """
+    The internship offers whose applications a user with the given staff groups (see ``get_staff_group_ids``)
+    may see.
+    """
+    applications = InternshipOffer.objects.only('id', 'title').order_by('title')
+    if group_ids is not None:
+        applications = applications.filter(company__group__in=group_ids)
+    return applications
+
+
+def filter_visible_profiles(queryset, group_ids):
+    """
+    Limit ``queryset`` to the students a user with the given staff groups may see, and prefetch the applications
+    they may see as ``visible_applications``.
+    """
+    if group_ids is not None:
+        # userul vede doar studentii care au aplicat la internshipurile companiei din grupul in care e asignat,
+        # si doar aplicarile la acestea
+        visible = StudentProfile.applications.through.objects.filter(
+            studentprofile=OuterRef('pk'), internshipoffer__company__group__in=group_ids)
+        queryset = queryset.filter(Exists(visible))
+    return queryset.prefetch_related(
+        Prefetch('applications', queryset=get_visible_applications(group_ids), to_attr='visible_applications'))
+
+
+def get_profile_applications(profile):
+    """
+    The applications of ``profile`` that the user of the current request may see, prefetched by
+    ``filter_visible_profiles`` if the profile was loaded through it.
+    """
+    applications = getattr(profile, 'visible_applications', None)
+    if applications is None:
+        applications = get_visible_applications(get_staff_group_ids()).filter(applicants=profile)
+    return applications
+
+
 class StudentProfileResource(resources.ModelResource):
     id = resources.Field(attribute='id', readonly=True)
     first_name = resources.Field(attribute='user__first_name', column_name='first_name')
@@ -79,16 +114,12 @@ class StudentProfileResource(resources.ModelResource):
     email = resources.Field(attribute='user__email', column_name='email')
     study_class = resources.Field(attribute='study_class_id', column_name='serie')
     cv_url = resources.Field(attribute='cv_url', column_name='cv')
-    user = None
+    applications = resources.Field(column_name='applications')
 
-    def get_queryset(self, request):
-        self.user = request.user
-        qs = super().get_queryset(request).distinct()
-        if self.user.is_staff and not self.user.is_superuser:
-            groups = self.user.groups.all()
-            qs = qs.filter(applications__company__group__in=groups)
-            # userul vede doar studentii care au aplicat la internshipurile companiei din grupul in care e asignat
-        return qs
+    def get_queryset(self):
+        # scoped to the user of the current request, the resource isn't passed it
+        qs = super().get_queryset().select_related('user', 'study_class')
+        return filter_visible_profiles(qs, get_staff_group_ids())
 
     def dehydrate_study_class(self, profile):
         return str(profile.study_class)
@@ -97,10 +128,8 @@ class StudentProfileResource(resources.ModelResource):
         cv_url = profile.cv_url
         return build_absolute_uri(None, cv_url) if cv_url else ""
 
-    # def dehydrate_applications(self, profile):
-    #     user = request.user
-    #     groups = user.groups.all()
-    #     return '\n'.join([p.title for p in profile.applications.filter(company__group__in=groups)])
+    def dehydrate_applications(self, profile):
+        return '\n'.join([p.title for p in get_profile_applications(profile)])
 
     class Meta:
         model = StudentProfile
@@ -111,23 +140,17 @@ class StudentProfileResource(resources.ModelResource):
 
 # noinspection PyTypeChecker
 @admin.register(StudentProfile)
-class StudentProfileAdmin(StudentListAdminMixin, admin.ModelAdmin):
+class StudentProfileAdmin(StudentListAdminMixin, StreamingExportMixin, ExportMixin, admin.ModelAdmin):
     list_display = StudentListAdminMixin.list_display + ( 'phone', 'email', 'get_cv_url',
                   'get_linkedin_url', 'get_github_url', 'get_applications','created_date', )
     resource_class = StudentProfileResource
     change_list_template = 'admin/import_export/change_list_export.html'
     filter_horizontal = ('applications',)
-
-    user = None
+    list_filter = (ProfileCompletionListFilter,)
 
     def get_queryset(self, request):
-        self.user = request.user
-        qs = super().get_queryset(request).distinct()
-        if self.user.is_staff and not self.user.is_superuser:
-            groups = self.user.groups.all()
-            qs = qs.filter(applications__company__group__in=groups)
-            # userul vede doar studentii care au aplicat la internshipurile companiei din grupul in care e asignat
-        return qs
+        qs = super().get_queryset(request).select_related('user', 'study_class')
+        return filter_visible_profiles(qs, get_staff_group_ids(request))
 
     def get_list_display_links(self, request, list_display):
         if request.user.is_staff and not request.user.is_superuser:
@@ -135,11 +158,7 @@ class StudentProfileAdmin(StudentListAdminMixin, admin.ModelAdmin):
         return super(StudentProfileAdmin, self).get_list_display_links(request, list_display)
 
     def get_applications(self, obj,):
-        applications = obj.applications.all()
-        if self.user.is_staff and not self.user.is_superuser:
-            groups = self.user.groups.all()
-            applications = applications.filter(company__group__in=groups)
-        return format_html("<br/>".join([p.title for p in applications]))
+        return format_html_join(mark_safe("<br/>"), "{}", ((p.title,) for p in get_profile_applications(obj)))
 
     def get_cv_url(self, obj,):
         if obj.cv_url:
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StudentsConfig(AppConfig):
     name = 'students'
+
+    def ready(self):
+        # noinspection PyUnresolvedReferences
+        import students.signals  # noqa: F401
@@ -0,0 +1,37 @@
+from django.db.models import Q, Exists, OuterRef
+
+
+def get_profile_model():
+    from students.models import StudentProfile
+    return StudentProfile
+
+
+# a profile is complete once the student applied somewhere and has a CV or a LinkedIn profile to show
+HAS_RESUME_Q = (Q(cv__isnull=False) & ~Q(cv__exact='')) | (Q(linkedin__isnull=False) & ~Q(linkedin__exact=''))
+
+
+def is_profile_complete(profile):
+    """
+    Compute the ``is_complete`` flag of a profile about to be saved, without relying on the stored one.
+    """
+    if not (profile.cv or profile.linkedin):
+        return False
+    return not profile._state.adding and profile.applications.exists()
+
+
+def update_profile_completion(profile_ids=None):
+    """
+    Recompute the ``is_complete`` flag of the given profiles (all of them by default) with a single ``UPDATE``,
+    after their applications changed.
+    """
+    StudentProfile = get_profile_model()
+    applications = StudentProfile.applications.through.objects.filter(studentprofile=OuterRef('pk'))
+    complete = StudentProfile.objects.filter(HAS_RESUME_Q, pk=OuterRef('pk')).filter(Exists(applications))
+    profiles = StudentProfile.objects.all()
+    if profile_ids is not None:
+        profile_ids = list(profile_ids)
+        if not profile_ids:
+            return
+        profiles = profiles.filter(pk__in=profile_ids)
+
+    profiles.update(is_complete=Exists(complete))
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:58
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Q
+
+
+def fill_is_complete(apps, schema_editor):
+    StudentProfile = apps.get_model('students', 'StudentProfile')
+    Application = StudentProfile._meta.get_field('applications').remote_field.through
+
+    has_resume = (Q(cv__isnull=False) & ~Q(cv__exact='')) | (Q(linkedin__isnull=False) & ~Q(linkedin__exact=''))
+    complete = StudentProfile.objects.filter(has_resume, pk=OuterRef('pk')) \
+        .filter(Exists(Application.objects.filter(studentprofile=OuterRef('pk'))))
+    StudentProfile.objects.update(is_complete=Exists(complete))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0009_auto_20220606_1828'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studentprofile',
+            name='is_complete',
+            field=models.BooleanField(db_index=True, default=False, editable=False, verbose_name='Profile complete'),
+        ),
+        migrations.RunPython(fill_is_complete, migrations.RunPython.noop),
+    ]
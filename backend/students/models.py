@@ -2,7 +2,8 @@ import os
 import uuid
 
 from django.conf import settings
-from django.db import models
+from django.db import models, connections, transaction, IntegrityError, router
+from django.db.models.signals import m2m_changed
 from django.db.models import URLField
 from django.urls import reverse
 from django.utils.text import get_valid_filename
@@ -10,6 +11,7 @@ from phonenumber_field.modelfields import PhoneNumberField
 from private_storage.fields import PrivateFileField
 
 from internships.models import InternshipOffer
+from students.completion import is_profile_complete
 from users.models import StudentClass
 from util.models import CreatedModifiedMixin
 
@@ -34,6 +36,8 @@ class StudentProfile(CreatedModifiedMixin):
     email = models.EmailField("Email", blank=True, null=True)
     cv = PrivateFileField("CV", upload_to="cv", blank=True, null=True,
                           max_file_size=10 * 1024 * 1024, content_types=document_types)
+    # maintained on save and when the applications change, see students.completion
+    is_complete = models.BooleanField("Profile complete", default=False, db_index=True, editable=False)
 
     @property
     def cv_filename(self):
@@ -53,6 +57,113 @@ class StudentProfile(CreatedModifiedMixin):
 
     applications = models.ManyToManyField(InternshipOffer, blank=True, related_name='applicants')
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'cv', 'linkedin'} & set(update_fields):
+            self.is_complete = is_profile_complete(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'is_complete'}
+        super().save(*args, **kwargs)
+
+    def add_application(self, internship_id):
+        """
+        Apply to the internship offer with the given id, with a single ``INSERT ... SELECT`` that relies on the
+        unique constraint of the through table, so concurrent requests can't apply twice.
+
+        Returns ``False`` if the student had already applied, or if there is no such offer visible to students.
+        """
+        through = StudentProfile.applications.through
+        offer_field = through._meta.get_field('internshipoffer')
+        profile_field = through._meta.get_field('studentprofile')
+        using = router.db_for_write(through, instance=self)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+
+        company_field = InternshipOffer._meta.get_field('company')
+        company_model = company_field.related_model
+        sql = 'INSERT INTO {through} ({profile_column}, {offer_column}) ' \
+              'SELECT %s, {offers}.{pk} FROM {offers} ' \
+              'INNER JOIN {companies} ON {companies}.{company_pk} = {offers}.{company_column} ' \
+              'WHERE {offers}.{pk} = %s AND {companies}.{visible} = %s'.format(
+            through=qn(through._meta.db_table),
+            profile_column=qn(profile_field.column),
+            offer_column=qn(offer_field.column),
+            offers=qn(InternshipOffer._meta.db_table),
+            pk=qn(InternshipOffer._meta.pk.column),
+            company_column=qn(company_field.column),
+            companies=qn(company_model._meta.db_table),
+            company_pk=qn(company_model._meta.pk.column),
+            visible=qn(company_model._meta.get_field('visible_for_students').column),
+        )
+        params = [profile_field.target_field.get_db_prep_value(self.pk, connection),
+                  offer_field.target_field.get_db_prep_value(internship_id, connection),
+                  True]
+
+        try:
+            with transaction.atomic(using=using), connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                inserted = cursor.rowcount
+        except IntegrityError:
+            return False
+
+        if not inserted:
+            return False
+        self.applications_changed('post_add', {internship_id}, using)
+        return True
+
+    def remove_application(self, internship_id):
+        """
+        Withdraw the application to the internship offer with the given id, with a single ``DELETE``.
+        Returns ``False`` if the student had not applied to it.
+        """
+        through = StudentProfile.applications.through
+        using = router.db_for_write(through, instance=self)
+        deleted, _ = through.objects.using(using).filter(studentprofile=self.pk, internshipoffer=internship_id).delete()
+        if not deleted:
+            return False
+
+        self.applications_changed('post_remove', {internship_id}, using)
+        return True
+
+    def set_applications(self, internship_ids):
+        """
+        Replace the student's applications with the internship offers with the given ids. The ids are
+        validated with a single query, and the difference to the current applications is written with one
+        bulk insert and one bulk delete, in a single transaction.
+
+        Raises ``InternshipOffer.DoesNotExist`` if any of the new offers doesn't exist or isn't visible to students
+        (like ``add_application``); applications made before an offer was hidden can be kept.
+        """
+        through = StudentProfile.applications.through
+        using = router.db_for_write(through, instance=self)
+        internship_ids = set(internship_ids)
+
+        with transaction.atomic(using=using):
+            applications = through.objects.using(using).filter(studentprofile=self.pk)
+            current = set(applications.values_list('internshipoffer_id', flat=True))
+            removed, added = current - internship_ids, internship_ids - current
+
+            if added and added != set(InternshipOffer.objects.using(using)
+                                      .filter(pk__in=added, company__visible_for_students=True)
+                                      .values_list('pk', flat=True)):
+                raise InternshipOffer.DoesNotExist
+
+            if removed:
+                applications.filter(internshipoffer__in=removed).delete()
+                self.applications_changed('post_remove', removed, using)
+            if added:
+                through.objects.using(using).bulk_create(
+                    [through(studentprofile_id=self.pk, internshipoffer_id=pk) for pk in added],
+                    ignore_conflicts=True,
+                )
+                self.applications_changed('post_add', added, using)
+
+    def applications_changed(self, action, pk_set, using):
+        # the writes above bypass the related manager, which would send m2m_changed itself
+        self._prefetched_objects_cache = {}
+        m2m_changed.send(sender=StudentProfile.applications.through, instance=self, action=action, reverse=False,
+                         model=InternshipOffer, pk_set=pk_set, using=using)
+
     def __str__(self):
         return self.user.get_full_name()
 
@@ -12,6 +12,8 @@ from rest_framework.serializers import ModelSerializer
 from internships.models import InternshipOffer
 from students.models import StudentProfile
 from users.schema import StudentClassNode
+from util.loaders import load_related
+from util.optimizer import optimize_queryset
 from util.schema import SerializerMutation
 from graphql import GraphQLError
 from uuid import UUID
@@ -24,10 +26,20 @@ class StudentProfileNode(DjangoObjectType):
         model = StudentProfile
         interfaces = (relay.Node,)
 
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
     def resolve_cv(self, info):
         profile = self  # type: StudentProfile
         return profile.cv_url
 
+    def resolve_study_class(self, info):
+        return load_related(info, self, 'study_class')
+
+    def resolve_applications(self, info, **kwargs):
+        return load_related(info, self, 'applications')
+
 
 class StudentProfileSerializer(ModelSerializer):
     class Meta:
@@ -77,6 +89,24 @@ class StudentProfileMutation(SerializerMutation):
         return cls(profile=instance)
 
 
+def get_student_profile(info):
+    user = info.context.user
+    if not user.is_authenticated:
+        raise PermissionDenied("Authentication required")
+
+    profile = getattr(user, 'student', None)  # type: StudentProfile
+    if not profile:
+        raise PermissionDenied("no student profile associated with current user")
+    return profile
+
+
+def parse_internship_id(internship_id):
+    try:
+        return UUID(internship_id)
+    except (TypeError, ValueError):
+        raise GraphQLError("Invalid internshipId!")
+
+
 class AddApplicationMutation(graphene.Mutation):
     class Arguments:
         # The input arguments for this mutation
@@ -86,28 +116,13 @@ class AddApplicationMutation(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, internshipId):
-        if not info.context.user.is_authenticated:
-            raise PermissionDenied("Authentication required")
-
-        user = info.context.user
-        if not user:
-            raise PermissionDenied("Authentication required")
-
-        profile = StudentProfile.objects.get(user=user)
-
-        if not profile:
-            raise PermissionDenied("no student profile associated with current user")
-        internship = InternshipOffer.objects.get(id=internshipId)
-
-        if not internship:
+        profile = get_student_profile(info)
+        internship_id = parse_internship_id(internshipId)
+        if not profile.add_application(internship_id):
+            if profile.applications.filter(pk=internship_id).exists():
+                raise GraphQLError("Already applied!")
             raise GraphQLError("Invalid internshipId!")
 
-        if profile.applications.filter(id=internshipId).exists():
-            raise GraphQLError("Already applied!")
-
-        profile.applications.add(internship)
-        print('User ' + user.email + ' added application for ' + internship.title)
-
         # Notice we return an instance of this mutation
         return AddApplicationMutation(profile=profile)
 
@@ -121,31 +136,33 @@ class RemoveApplicationMutation(graphene.Mutation):
 
     @classmethod
     def mutate(cls, root, info, internshipId):
-        if not info.context.user.is_authenticated:
-            raise PermissionDenied("Authentication required")
+        profile = get_student_profile(info)
+        if not profile.remove_application(parse_internship_id(internshipId)):
+            raise GraphQLError("Not applied!")
 
-        user = info.context.user
-        if not user:
-            raise PermissionDenied("Authentication required")
+        # Notice we return an instance of this mutation
+        return RemoveApplicationMutation(profile=profile)
 
-        profile = StudentProfile.objects.get(user=user)
+class SetApplicationsMutation(graphene.Mutation):
+    class Arguments:
+        internshipIds = graphene.List(graphene.NonNull(graphene.ID), required=True,
+                                      description="The internships to apply to. Other applications are withdrawn.")
 
-        if not profile:
-            raise PermissionDenied("no student profile associated with current user")
-        internship = InternshipOffer.objects.get(id=internshipId)
+    profile = graphene.Field(StudentProfileNode)
 
-        if not internship:
+    @classmethod
+    def mutate(cls, root, info, internshipIds):
+        profile = get_student_profile(info)
+        try:
+            profile.set_applications([parse_internship_id(internship_id) for internship_id in internshipIds])
+        except InternshipOffer.DoesNotExist:
             raise GraphQLError("Invalid internshipId!")
 
-        if not profile.applications.filter(id=internshipId).exists():
-            raise GraphQLError("Not applied!")
+        return SetApplicationsMutation(profile=profile)
 
-        profile.applications.remove(internship)
-        print('User ' + user.email + ' removed application for ' + internship.title)
-        # Notice we return an instance of this mutation
-        return AddApplicationMutation(profile=profile)
 
 class Mutation(object):
     update_profile = StudentProfileMutation.Field()
     add_application = AddApplicationMutation.Field()
-    remove_application = RemoveApplicationMutation.Field()
\ No newline at end of file
+    remove_application = RemoveApplicationMutation.Field()
+    set_applications = SetApplicationsMutation.Field()
\ No newline at end of file
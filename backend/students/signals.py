@@ -0,0 +1,29 @@
+from django.db.models.signals import pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from internships.models import InternshipOffer
+from students.completion import update_profile_completion
+from students.models import StudentProfile
+
+
+@receiver(m2m_changed, sender=StudentProfile.applications.through)
+def profile_applications_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_applicant_ids = list(instance.applicants.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        update_profile_completion(instance.__dict__.pop('_cleared_applicant_ids', []) if reverse else [instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        update_profile_completion(pk_set if reverse else [instance.pk])
+
+
+@receiver(pre_delete, sender=InternshipOffer)
+def internship_deleting(sender, instance, **kwargs):
+    # the applications are deleted along with the offer, without m2m_changed
+    instance._deleted_applicant_ids = list(instance.applicants.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=InternshipOffer)
+def internship_deleted(sender, instance, **kwargs):
+    applicant_ids = instance.__dict__.pop('_deleted_applicant_ids', [])
+    if applicant_ids:
+        update_profile_completion(applicant_ids)
@@ -1,3 +1,257 @@
-from django.test import TestCase
+import csv
+import io
+import uuid
 
-# Create your tests here.
+from django.contrib.admin import site
+from django.contrib.auth.models import Group, Permission
+from django.db import connection
+from django.db.models.signals import m2m_changed
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from internships.models import Company, InternshipOffer, FacultyTag
+from students.admin import StudentProfileResource, ProfileCompletionListFilter
+from students.models import StudentProfile
+from users.backends import issue_token
+from users.models import User, StudentClass
+from util.admin import get_nested_filters
+from util.middleware import current_request
+
+
+class StudentProfileAdminTestCase(TestCase):
+    url = '/admin/students/studentprofile/'
+
+    def setUp(self):
+        self.study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        self.group = Group.objects.create(name='Company')
+        self.group.permissions.add(Permission.objects.get(codename='view_studentprofile'))
+        company = Company.objects.create(name='Company', slug='company', description='-', group=self.group)
+        other_company = Company.objects.create(name='Other', slug='other', description='-')
+        self.offer = InternshipOffer.objects.create(company=company, title='Visible', is_paid=True, capacity=2,
+                                                    target_group=faculty)
+        self.other_offer = InternshipOffer.objects.create(company=other_company, title='Hidden', is_paid=True,
+                                                          capacity=2, target_group=faculty)
+        self.staff = User.objects.create(email='hr@company.ro', username='hr', is_staff=True)
+        self.staff.groups.add(self.group)
+
+    def create_applicants(self, count, applications):
+        start = StudentProfile.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create(email=f'student{i}@stud.acs.upb.ro', username=f'student{i}',
+                                       first_name='Ana', last_name=f'Student {i}')
+            StudentProfile.objects.create(user=user, study_class=self.study_class).applications.set(applications)
+
+    def get_changelist(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_staff_changelist_queries_do_not_grow_with_rows(self):
+        self.client.force_login(self.staff)
+        self.create_applicants(2, [self.offer, self.other_offer])
+        self.create_applicants(1, [self.other_offer])
+        _, query_count = self.get_changelist()
+
+        self.create_applicants(6, [self.offer, self.other_offer])
+        response, more_query_count = self.get_changelist()
+
+        self.assertEqual(more_query_count, query_count)
+        profiles = response.context['cl'].result_list
+        self.assertEqual(len(profiles), 8)
+        for profile in profiles:
+            self.assertEqual([offer.title for offer in profile.visible_applications], ['Visible'])
+        self.assertContains(response, 'Visible', count=8)
+        self.assertNotContains(response, 'Hidden')
+
+    def test_nested_filters(self):
+        self.create_applicants(2, [self.offer, self.other_offer])
+        self.create_applicants(1, [])
+        queryset = StudentProfile.objects.all()
+
+        for field, value, count in (('applications', '1', 2), ('applications', '0', 1),
+                                    ('applications__company__group', '1', 2), ('study_class', '1', 3)):
+            list_filter = get_nested_filters(field, field)(None, {f'has_{field}': value}, StudentProfile, None)
+            with self.assertNumQueries(1):
+                self.assertEqual(len(list_filter.queryset(None, queryset)), count)
+
+    def export_csv(self):
+        formats = site._registry[StudentProfile].get_export_formats()
+        file_format = next(i for i, f in enumerate(formats) if f().get_title() == 'csv')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url + 'export/', {'file_format': file_format})
+            self.assertTrue(response.streaming)
+            rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        return rows, len(queries)
+
+    def test_staff_export_is_streamed_in_chunks(self):
+        self.client.force_login(self.staff)
+        self.create_applicants(2, [self.offer, self.other_offer])
+        self.create_applicants(1, [self.other_offer])
+        _, query_count = self.export_csv()
+
+        self.create_applicants(6, [self.offer, self.other_offer])
+        rows, more_query_count = self.export_csv()
+
+        self.assertEqual(more_query_count, query_count)
+        self.assertEqual(len(rows), 9)
+        applications = rows[0].index('applications')
+        self.assertTrue(all(row[applications] == 'Visible' and row[0] == '3 CTI' for row in rows[1:]))
+
+    def test_export_is_scoped_to_current_request(self):
+        self.create_applicants(2, [self.offer, self.other_offer])
+        self.create_applicants(1, [self.other_offer])
+
+        dataset = StudentProfileResource().export()
+        self.assertEqual(sorted(dataset['applications']), ['Hidden'] + ['Hidden\nVisible'] * 2)
+
+        request = RequestFactory().get(self.url)
+        request.user = self.staff
+        token = current_request.set(request)
+        try:
+            dataset = StudentProfileResource().export()
+        finally:
+            current_request.reset(token)
+        self.assertEqual(dataset['applications'], ['Visible'] * 2)
+
+
+class ProfileCompletionTestCase(TestCase):
+    def setUp(self):
+        study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        company = Company.objects.create(name='Company', slug='company', description='-', visible_for_students=True)
+        self.offers = [InternshipOffer.objects.create(company=company, title=f'Offer {i}', is_paid=True, capacity=2,
+                                                      target_group=faculty) for i in range(2)]
+        user = User.objects.create(email='student@stud.acs.upb.ro', username='student')
+        self.profile = StudentProfile.objects.create(user=user, study_class=study_class,
+                                                     linkedin='https://linkedin.com/in/student')
+
+    def assertComplete(self, is_complete):
+        self.assertEqual(StudentProfile.objects.get(pk=self.profile.pk).is_complete, is_complete)
+
+    def test_is_complete_follows_applications_and_profile(self):
+        self.assertComplete(False)
+
+        self.profile.applications.add(self.offers[0])
+        self.assertComplete(True)
+        self.profile.applications.remove(self.offers[0])
+        self.assertComplete(False)
+        self.offers[1].applicants.add(self.profile)
+        self.assertComplete(True)
+        self.offers[1].applicants.clear()
+        self.assertComplete(False)
+
+        self.assertTrue(self.profile.add_application(self.offers[0].pk))
+        self.assertComplete(True)
+        self.profile.linkedin = ''
+        self.profile.save()
+        self.assertComplete(False)
+        self.profile.linkedin = 'https://linkedin.com/in/student'
+        self.profile.save(update_fields=['linkedin'])
+        self.assertComplete(True)
+
+        self.offers[0].delete()
+        self.assertComplete(False)
+
+    def test_reverse_clear_without_pre_clear_updates_nothing(self):
+        # a stale flag, which only a recomputation of every profile would fix
+        StudentProfile.objects.filter(pk=self.profile.pk).update(is_complete=True)
+        m2m_changed.send(sender=StudentProfile.applications.through, instance=self.offers[0], action='post_clear',
+                         reverse=True, model=StudentProfile, pk_set=None, using='default')
+        self.assertComplete(True)
+
+    def test_filter(self):
+        self.profile.set_applications([self.offers[0].pk])
+        queryset = StudentProfile.objects.all()
+        profile_filter = ProfileCompletionListFilter(None, {'profile_complete': '1'}, StudentProfile, None)
+        self.assertEqual(list(profile_filter.queryset(None, queryset)), [self.profile])
+        profile_filter = ProfileCompletionListFilter(None, {'profile_complete': '0'}, StudentProfile, None)
+        self.assertEqual(list(profile_filter.queryset(None, queryset)), [])
+
+
+class ApplicationsTestCase(TestCase):
+    query = 'mutation Apply($id: ID) { addApplication(internshipId: $id) { profile { id } } }'
+
+    def setUp(self):
+        study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        faculty = FacultyTag.objects.create(name='Calculatoare', code='CTI')
+        company = Company.objects.create(name='Company', slug='company', description='-', visible_for_students=True)
+        hidden_company = Company.objects.create(name='Hidden', slug='hidden', description='-')
+        self.offers = [InternshipOffer.objects.create(company=company, title=f'Offer {i}', is_paid=True, capacity=2,
+                                                      target_group=faculty) for i in range(2)]
+        self.hidden_offer = InternshipOffer.objects.create(company=hidden_company, title='Hidden', is_paid=True,
+                                                           capacity=2, target_group=faculty)
+        user = User.objects.create(email='student@stud.acs.upb.ro', username='student')
+        self.profile = StudentProfile.objects.create(user=user, study_class=study_class)
+
+        self.signals = []
+        m2m_changed.connect(self.record_signal, sender=StudentProfile.applications.through)
+        self.addCleanup(m2m_changed.disconnect, self.record_signal, sender=StudentProfile.applications.through)
+
+    def record_signal(self, sender, instance, action, reverse, model, pk_set, **kwargs):
+        self.signals.append((instance, action, reverse, model, pk_set))
+
+    def assertApplications(self, *offers):
+        self.assertEqual(set(self.profile.applications.all()), set(offers))
+        for offer in self.offers:
+            offer.refresh_from_db()
+            self.assertEqual(offer.applicant_count, int(offer in offers))
+
+    def test_apply_twice(self):
+        self.assertTrue(self.profile.add_application(self.offers[0].pk))
+        self.assertFalse(self.profile.add_application(self.offers[0].pk))
+        self.assertApplications(self.offers[0])
+        # sent by add_application itself, as it bypasses the related manager; the counters depend on it
+        self.assertEqual(self.signals, [(self.profile, 'post_add', False, InternshipOffer, {self.offers[0].pk})])
+
+    def test_apply_to_missing_or_hidden_offer(self):
+        self.assertFalse(self.profile.add_application(uuid.uuid4()))
+        self.assertFalse(self.profile.add_application(self.hidden_offer.pk))
+        self.assertApplications()
+        self.assertEqual(self.signals, [])
+
+    def test_withdraw(self):
+        self.assertFalse(self.profile.remove_application(self.offers[0].pk))
+        self.assertEqual(self.signals, [])
+
+        self.profile.add_application(self.offers[0].pk)
+        self.assertTrue(self.profile.remove_application(self.offers[0].pk))
+        self.assertApplications()
+        self.assertEqual(self.signals[-1], (self.profile, 'post_remove', False, InternshipOffer, {self.offers[0].pk}))
+
+    def test_set_applications(self):
+        self.profile.set_applications([self.offers[0].pk, self.offers[0].pk])
+        self.assertApplications(self.offers[0])
+
+        self.profile.set_applications([self.offers[1].pk, self.offers[1].pk])
+        self.assertApplications(self.offers[1])
+        self.assertEqual(self.signals[-2:], [
+            (self.profile, 'post_remove', False, InternshipOffer, {self.offers[0].pk}),
+            (self.profile, 'post_add', False, InternshipOffer, {self.offers[1].pk}),
+        ])
+
+        for invalid in (uuid.uuid4(), self.hidden_offer.pk):
+            with self.assertRaises(InternshipOffer.DoesNotExist):
+                self.profile.set_applications([self.offers[0].pk, invalid])
+            self.assertApplications(self.offers[1])
+
+        # unchanged applications are kept, even if the offer was hidden since
+        self.hidden_offer.company.visible_for_students = True
+        self.hidden_offer.company.save()
+        self.profile.set_applications([self.hidden_offer.pk])
+        self.hidden_offer.company.visible_for_students = False
+        self.hidden_offer.company.save()
+        signal_count = len(self.signals)
+        self.profile.set_applications([self.hidden_offer.pk])
+        self.assertEqual(len(self.signals), signal_count)
+
+    def test_add_application_mutation(self):
+        token = issue_token(self.profile.user).key
+        for internship_id, error in ((self.offers[0].pk, None), (self.offers[0].pk, 'Already applied!'),
+                                     (self.hidden_offer.pk, 'Invalid internshipId!'), ('x', 'Invalid internshipId!')):
+            response = self.client.post('/graphql', {'query': self.query, 'variables': {'id': str(internship_id)}},
+                                        content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+            errors = response.json().get('errors')
+            self.assertEqual(errors and errors[0]['message'], error)
+        self.assertApplications(self.offers[0])
@@ -11,12 +11,14 @@ from graphene_django import DjangoObjectType
 from graphql import GraphQLError
 
 from students.models import StudentProfile
-from users.backends import logout
+from users.backends import logout, issue_token
 from users.models import Token
 
-from users.models import User, StudentClass
+from users.models import User, get_student_class
 
+from users.auth_service import AuthServiceUnavailable
 from users.backends import do_external_login
+from util.optimizer import optimize_queryset
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +31,10 @@ class UserNode(DjangoObjectType):
         interfaces = (relay.Node,)
         exclude_fields = ('password', 'tokens', 'prefill')
 
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
 
 class TokenNode(DjangoObjectType):
     class Meta:
@@ -44,7 +50,7 @@ def handle_login_response(response):
 
     user = get_user_or_create_from_login_props(response['rezultat'])
 
-    token = Token.objects.create(user=user)
+    token = issue_token(user)
 
     return {'user' : user, 'token': token}
 
@@ -52,17 +58,12 @@ def handle_login_response(response):
 
 def get_user_or_create_from_login_props(props):
 
-    try:
-        user = User.objects.get(reg = props['marca'])
-    except User.DoesNotExist:
-        user = None
-
+    user = User.objects.select_related('student').filter(reg=props['marca']).first()
     if user:
         return user
 
-    try:
-        study_class = StudentClass.objects.get(name = props['profil'], study_year = props['an'])
-    except StudentClass.DoesNotExist:
+    study_class = get_student_class(props['profil'], props['an'])
+    if study_class is None:
         raise GraphQLError('Doar studenții din anul 3 de la CTI, CTI Engleză, IS, ' +
                            'respectiv anul 2 IS, IS ID pot trimite aplicații')
 
@@ -103,7 +104,11 @@ class LoginMutation(ClientIDMutation):
 
     @classmethod
     def mutate_and_get_payload(cls, root, info, email, password):
-        response = do_external_login(email,password)
+        try:
+            response = do_external_login(email, password)
+        except AuthServiceUnavailable:
+            raise GraphQLError('Serviciul de autentificare nu este disponibil momentan. '
+                               'Te rugăm să încerci din nou în câteva minute.')
 
         with transaction.atomic():
             login_info = handle_login_response(response)
@@ -119,8 +124,9 @@ class LogoutMutation(ClientIDMutation):
         )
         all = graphene.Boolean(
             required=False, default_value=False,
-            description="If true, invalidates all tokens of the currently logged in "
-                        "user except the one used to make the request."
+            description="If true, invalidates all tokens of the currently logged in user except the one "
+                        "used to make the request. Signed tokens can't be invalidated one at a time, so if "
+                        "the request was made with a signed token, that token is invalidated as well."
         )
 
     class Meta:
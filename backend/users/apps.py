@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class AccountConfig(AppConfig):
     name = 'users'
+
+    def ready(self):
+        # noinspection PyUnresolvedReferences
+        import users.signals  # noqa: F401
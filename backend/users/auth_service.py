@@ -0,0 +1,226 @@
+import atexit
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class AuthServiceUnavailable(Exception):
+    """
+    The auth service could not be reached, timed out, returned an invalid response,
+    or is being skipped because the circuit breaker is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Stops calling a failing service for ``reset_timeout`` seconds after ``failure_threshold`` consecutive
+    failures. Once the timeout passes, a single trial call is let through: if it succeeds the circuit closes
+    again, otherwise it stays open for another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.trial_running = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning("auth service circuit opened after %d failures", self.failures)
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+
+class LatencyStats(object):
+    """
+    Running counters for the calls made to the auth service, logged every ``report_interval`` seconds.
+    """
+
+    def __init__(self, report_interval=300):
+        self.report_interval = report_interval
+        self.reported_at = time.monotonic()
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds, failed):
+        with self.lock:
+            self.requests += 1
+            self.failures += failed
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def record_rejected(self):
+        with self.lock:
+            self.rejected += 1
+
+    def is_report_due(self):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.reported_at < self.report_interval:
+                return False
+            self.reported_at = now
+            return True
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'avg_seconds': self.total_seconds / self.requests if self.requests else 0.0,
+                'max_seconds': self.max_seconds,
+            }
+
+
+class AuthServiceClient(object):
+    """
+    Client for the university's authentication service. Keeps a pool of persistent connections, bounds
+    every call with connect and read timeouts and stops calling the service while it is failing, so a slow
+    or unavailable service fails logins fast instead of tying up the web workers.
+    """
+
+    def __init__(self, url, api_key, connect_timeout=3, read_timeout=10, pool_size=10,
+                 failure_threshold=5, reset_timeout=30, stats_interval=300):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.stats = LatencyStats(stats_interval)
+
+        self.session = requests.Session()
+        # logins are not idempotent enough to retry blindly, and a retry would double the worst-case latency
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def login(self, email, password):
+        """
+        Check the credentials with the auth service and return its decoded response.
+        Raises ``AuthServiceUnavailable`` if no valid response could be obtained.
+        """
+        self.check_circuit()
+        start = time.monotonic()
+        try:
+            http_response = self.session.post(self.url, json=self.get_payload(email, password),
+                                              headers=self.get_headers(), timeout=self.timeout)
+            response = self.decode(http_response.status_code, http_response.json)
+        except (requests.RequestException, ValueError, AuthServiceUnavailable) as e:
+            raise self.request_failed(start, e)
+
+        return self.request_succeeded(start, response)
+
+    def close(self):
+        """
+        Close the pooled connections.
+        """
+        self.report_stats("exit")
+        self.session.close()
+
+    def report_stats(self, reason):
+        # the counters are per process, so every worker reports its own
+        logger.info("auth service stats (%s): %s", reason, self.stats.as_dict())
+
+    def get_payload(self, email, password):
+        return {"cerere": {"cod": 0, "utilizator": email, "parola": password}}
+
+    def get_headers(self):
+        return {'X-API-KEY': self.api_key}
+
+    def check_circuit(self):
+        if not self.breaker.allow_request():
+            self.stats.record_rejected()
+            raise AuthServiceUnavailable("circuit open")
+
+    def decode(self, status_code, get_json):
+        if status_code >= 500:
+            raise AuthServiceUnavailable(f"status {status_code}")
+        return get_json()
+
+    def request_failed(self, start, error):
+        elapsed = time.monotonic() - start
+        self.stats.record(elapsed, failed=True)
+        was_open = self.breaker.is_open
+        self.breaker.record_failure()
+        if not was_open and self.breaker.is_open:
+            self.report_stats("circuit opened")
+        elif self.stats.is_report_due():
+            self.report_stats("periodic")
+        logger.warning("auth service call failed after %.3fs: %s", elapsed, error)
+        if isinstance(error, AuthServiceUnavailable):
+            return error
+        unavailable = AuthServiceUnavailable(str(error))
+        unavailable.__cause__ = error
+        return unavailable
+
+    def request_succeeded(self, start, response):
+        elapsed = time.monotonic() - start
+        self.stats.record(elapsed, failed=False)
+        was_open = self.breaker.is_open
+        self.breaker.record_success()
+        if was_open:
+            self.report_stats("circuit closed")
+        elif self.stats.is_report_due():
+            self.report_stats("periodic")
+        logger.debug("auth service call took %.3fs", elapsed)
+        return response
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_auth_service_client():
+    """
+    Return the process-wide ``AuthServiceClient``, creating it from the settings on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AuthServiceClient(
+                settings.AUTH_SERVICE_URL,
+                settings.AUTH_SERVICE_API_KEY,
+                connect_timeout=settings.AUTH_SERVICE_CONNECT_TIMEOUT,
+                read_timeout=settings.AUTH_SERVICE_READ_TIMEOUT,
+                pool_size=settings.AUTH_SERVICE_POOL_SIZE,
+                failure_threshold=settings.AUTH_SERVICE_FAILURE_THRESHOLD,
+                reset_timeout=settings.AUTH_SERVICE_RESET_TIMEOUT,
+                stats_interval=settings.AUTH_SERVICE_STATS_INTERVAL,
+            )
+            # the worker process can exit without a request being served, so this can't be tied to one
+            atexit.register(_client.close)
+        return _client
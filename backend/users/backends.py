@@ -1,10 +1,19 @@
+import copy
+import hashlib
 import logging
-import requests
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
 
 from django.contrib.auth import get_user_model, logout as django_logout
+from django.core.cache import cache
+from django.db.models import F
 from django.utils import timezone
 
+from users.auth_service import get_auth_service_client
 from users.models import Token
+from users.tokens import default_signed_token_generator
 
 from django.conf import settings
 
@@ -27,21 +36,195 @@ def get_token_from_request(request):
 def get_valid_token(token: str):
     """
     Get the Token object associated with the given ``token`` string, and check the expiration date before returning it.
-    Expired tokens are deleted and ``None`` is returned in all failure cases (expired, not found, etc).
+    ``None`` is returned in all failure cases (expired, not found, etc). Expired tokens are left for
+    ``purge_expired_tokens`` to delete, so this never writes to the database.
     """
     if token:
         try:
             t = Token.objects.select_related('user').get(key=token)
             if timezone.now() <= t.expiration:
                 return t
-            else:
-                t.delete()
         except Token.DoesNotExist:
             pass
 
     return None
 
 
+def purge_expired_tokens(batch_size=1000):
+    """
+    Delete expired tokens, ``batch_size`` rows at a time so the table is never locked for long,
+    and return how many were deleted.
+    """
+    deleted = 0
+    now = timezone.now()
+    while True:
+        keys = list(Token.objects.filter(expiration__lt=now).values_list('key', flat=True)[:batch_size])
+        if not keys:
+            return deleted
+        deleted += Token.objects.filter(key__in=keys).delete()[0]
+
+
+class TokenCache(object):
+    """
+    Maps tokens (and, for signed tokens, user ids) to users, so authenticated API requests don't need a query.
+
+    Entries are kept in the shared django cache and in a small per-process LRU in front of it, under a hash
+    of the token, and never outlive the token's expiration. The per-process copies can't be evicted from
+    other processes, so they are only kept for ``TOKEN_LOCAL_CACHE_TIMEOUT`` seconds; deleted tokens and
+    changed users are evicted from the shared cache by ``users.signals``.
+    """
+
+    def __init__(self):
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(token):
+        return 'auth-token:' + hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def get_user_key(user_id):
+        return f'auth-user:{user_id}'
+
+    def get(self, token):
+        return self.get_entry(self.get_key(token))
+
+    def set(self, token, user, expiration):
+        self.set_entry(self.get_key(token), user, expiration.timestamp())
+
+    def delete(self, *tokens):
+        self.delete_entries([self.get_key(token) for token in tokens])
+
+    def get_user(self, user_id):
+        return self.get_entry(self.get_user_key(user_id))
+
+    def set_user(self, user):
+        self.set_entry(self.get_user_key(user.pk), user, time.time() + settings.TOKEN_CACHE_TIMEOUT)
+
+    def delete_user(self, user_id):
+        self.delete_entries([self.get_user_key(user_id)])
+
+    def get_entry(self, key):
+        now = time.time()
+
+        with self.lock:
+            entry = self.local.get(key)
+            if entry and entry[2] > now:
+                self.local.move_to_end(key)
+                return entry[0]
+            self.local.pop(key, None)
+
+        entry = cache.get(key)
+        if entry is None or entry[1] <= now:
+            return None
+
+        self.set_local(key, *entry, now=now)
+        return entry[0]
+
+    def set_entry(self, key, user, expires_at):
+        now = time.time()
+        timeout = min(settings.TOKEN_CACHE_TIMEOUT, expires_at - now)
+        if timeout <= 0:
+            return
+
+        cache.set(key, (user, expires_at), int(timeout) or 1)
+        self.set_local(key, user, expires_at, now=now)
+
+    def set_local(self, key, user, expires_at, now):
+        with self.lock:
+            self.local[key] = (user, expires_at, min(expires_at, now + settings.TOKEN_LOCAL_CACHE_TIMEOUT))
+            self.local.move_to_end(key)
+            while len(self.local) > settings.TOKEN_LOCAL_CACHE_SIZE:
+                self.local.popitem(last=False)
+
+    def delete_entries(self, keys):
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
+        cache.delete_many(keys)
+
+
+token_cache = TokenCache()
+
+
+def get_signed_token_user(token: str):
+    """
+    Return the user that owns the signed ``token``, if the token is valid and has not been revoked
+    by bumping ``User.token_version``, or ``None`` otherwise.
+    """
+    signed = default_signed_token_generator.parse_token(token)
+    if not signed:
+        return None
+
+    user_id, expiration, version = signed
+    user = token_cache.get_user(user_id)
+    if user is None:
+        user = UserModel.objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+        token_cache.set_user(user)
+
+    if user.token_version != version:
+        return None
+
+    return copy.copy(user)
+
+
+def get_token_user(token: str):
+    """
+    Return the user that owns ``token``, if the token is valid, or ``None`` otherwise.
+    Uses ``token_cache`` and falls back to ``get_valid_token``.
+    """
+    if not token:
+        return None
+
+    if default_signed_token_generator.is_signed(token):
+        return get_signed_token_user(token)
+
+    user = token_cache.get(token)
+    if user is None:
+        t = get_valid_token(token)
+        if not t:
+            return None
+        user = t.user
+        token_cache.set(token, user, t.expiration)
+
+    # each request gets its own copy, since cached users are shared between requests
+    return copy.copy(user)
+
+
+def issue_token(user):
+    """
+    Create an access token for ``user``: a ``Token`` row, or an unsaved ``Token`` holding a signed token
+    if ``TOKEN_MODE`` is ``'signed'``. Both kinds are always accepted.
+
+    A ``Token`` created for the same user in the last ``TOKEN_REUSE_WINDOW`` seconds is returned instead
+    of a new one, so repeated logins don't add a row each.
+    """
+    if settings.TOKEN_MODE == 'signed':
+        return default_signed_token_generator.make_token(user)
+
+    if settings.TOKEN_REUSE_WINDOW:
+        now = timezone.now()
+        recent = Token.objects \
+            .filter(user=user, created__gte=now - timedelta(seconds=settings.TOKEN_REUSE_WINDOW), expiration__gt=now) \
+            .order_by('-created') \
+            .first()
+        if recent:
+            return recent
+
+    return Token.objects.create(user=user)
+
+
+def revoke_signed_tokens(user):
+    """
+    Revoke all signed tokens of ``user``. Signed tokens can't be revoked one at a time.
+    """
+    UserModel.objects.filter(pk=user.pk).update(token_version=F('token_version') + 1)
+    # queryset updates don't send post_save
+    token_cache.delete_user(user.pk)
+
+
 def logout(request, target_token=None, all_tokens=False):
     """
     Delete the authorization token from the request, and then logout from
@@ -50,10 +233,14 @@ def logout(request, target_token=None, all_tokens=False):
     If ``target_token`` is given, that token is deleted instead, and logout of ``request``
     is only performed if its token matches ``target_token``.
 
-    If ``all_tokens`` is True, all tokens associated with ``request.user``, except the token currently in use,
-    are deleted. It is not valid to pass both ``all_tokens`` and ``target_token``.
+    If ``all_tokens`` is True, all tokens associated with ``request.user``, except the token currently in use
+    if it isn't signed, are deleted. It is not valid to pass both ``all_tokens`` and ``target_token``.
 
-    Tokens can only be deleted if they are owned by ``request.user``.
+    Signed tokens can't be revoked individually, so invalidating one of them, or passing ``all_tokens``,
+    revokes all signed tokens of the user, including the one currently in use.
+
+    Tokens can only be deleted if they are owned by ``request.user``. Deleted tokens are evicted from
+    ``token_cache`` by ``users.signals``.
 
     Returns True if the targeted token(s) were deleted, or if no user was logged in to begin with.
     """
@@ -65,14 +252,24 @@ def logout(request, target_token=None, all_tokens=False):
     if all_tokens:
         if not logged_out:
             Token.objects.filter(user=request.user).exclude(key=req_token).delete()
+            revoke_signed_tokens(request.user)
             do_logout = True
             logged_out = True
     else:
         if not target_token:
             target_token = req_token
 
-        token_obj = get_valid_token(target_token)
-        if token_obj:
+        signed = default_signed_token_generator.parse_token(target_token)
+        token_obj = None if signed else get_valid_token(target_token)
+        if signed:
+            if signed[0] != request.user.pk:
+                logger.warning("%s attempts to revoke a signed token owned by user %s!", str(request.user), signed[0])
+                return False
+
+            revoke_signed_tokens(request.user)
+            do_logout = target_token == req_token
+            logged_out = True
+        elif token_obj:
             if token_obj.user != request.user:
                 logger.warning("%s attempts to delete token owned by %s!", str(request.user), str(token_obj.user))
                 return False
@@ -94,23 +291,16 @@ def logout(request, target_token=None, all_tokens=False):
     return logged_out
 
 def do_external_login(email, password):
-    auth_service_request_payload = {"cerere":{"cod":0,"utilizator":email,"parola":password}}
-    auth_service_request_headers = {'X-API-KEY': settings.AUTH_SERVICE_API_KEY}
-
-    http_response = requests.post(settings.AUTH_SERVICE_URL,
-                                 json=auth_service_request_payload, headers=auth_service_request_headers)
-
-    response = http_response.json()
-    return response
+    """
+    Check the credentials with the university's auth service and return its response.
+    Raises ``users.auth_service.AuthServiceUnavailable`` if the service can't be used.
+    """
+    return get_auth_service_client().login(email, password)
 
 
 class TokenBackend(object):
     def authenticate(self, request, token=None):
-        t = get_valid_token(token)
-        if not t:
-            return None
-
-        return t.user
+        return get_token_user(token)
 
     def get_user(self, user_id):
         try:
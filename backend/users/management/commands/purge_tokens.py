@@ -0,0 +1,44 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.backends import purge_expired_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Delete expired access tokens in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Number of tokens deleted per query.")
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Keep running and purge every INTERVAL seconds, instead of purging once.")
+        parser.add_argument('--retry-delay', type=int, default=60,
+                            help="When running with --interval, seconds to wait before retrying a failed purge.")
+
+    def handle(self, *args, **options):
+        if not options['interval']:
+            self.purge(options)
+            return
+
+        while True:
+            try:
+                self.purge(options)
+                delay = options['interval']
+            except Exception:
+                # e.g. the database isn't up yet; nothing would restart the command if it exited
+                logger.exception("purging expired tokens failed, retrying in %d seconds", options['retry_delay'])
+                delay = min(options['retry_delay'], options['interval'])
+
+            # don't hold on to a connection the database may close while sleeping, or that failed
+            close_old_connections()
+            time.sleep(delay)
+
+    def purge(self, options):
+        deleted = purge_expired_tokens(batch_size=options['batch_size'])
+        if options['verbosity'] > 1:
+            self.stdout.write(f"Deleted {deleted} expired tokens")
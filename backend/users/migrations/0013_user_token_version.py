@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_auto_20220404_2138'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='token_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Incremented to revoke all signed access tokens of the user'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 13:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_user_token_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='token',
+            name='expiration',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -7,11 +7,16 @@ from django.conf import settings
 from django.contrib.auth.base_user import AbstractBaseUser
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
 from django.core.exceptions import ValidationError
+from django.core.cache import cache
 from django.db import models, transaction
 from django.template.defaultfilters import title
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+TOKEN_LIFETIME = timedelta(days=7)
+
+STUDENT_CLASSES_CACHE_KEY = 'users:student-classes'
+
 
 class StudentClass(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -28,6 +33,31 @@ class StudentClass(models.Model):
         verbose_name_plural = _('Specialization')
 
 
+def get_student_class(name, study_year):
+    """
+    Return the ``StudentClass`` with the given name and study year, or ``None``. Names are compared
+    ignoring case and surrounding spaces.
+    All classes are cached together until one of them changes (see ``users.signals``).
+    """
+    classes = cache.get(STUDENT_CLASSES_CACHE_KEY)
+    if classes is None:
+        classes = {}
+        for student_class in StudentClass.objects.order_by('pk'):
+            classes.setdefault(get_student_class_key(student_class.name, student_class.study_year), student_class)
+        cache.set(STUDENT_CLASSES_CACHE_KEY, classes, None)
+
+    return classes.get(get_student_class_key(name, study_year))
+
+
+def get_student_class_key(name, study_year):
+    # the auth service isn't consistent about the case and spacing of class names
+    return str(name).strip().casefold(), str(study_year).strip()
+
+
+def invalidate_student_classes():
+    cache.delete(STUDENT_CLASSES_CACHE_KEY)
+
+
 class User(AbstractUser):
     """
     An abstract base class implementing a fully featured User model with
@@ -57,6 +87,8 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
     reg = models.CharField(max_length=32, unique=True, null=True, blank=True, default=None, help_text="Număr matricol")
+    token_version = models.PositiveIntegerField(default=0, editable=False,
+                                                help_text="Incremented to revoke all signed access tokens of the user")
 
 
     class Meta:
@@ -86,12 +118,12 @@ class Token(models.Model):
     key = models.CharField(max_length=40, primary_key=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="tokens")
     created = models.DateTimeField(auto_now_add=True)
-    expiration = models.DateTimeField()
+    expiration = models.DateTimeField(db_index=True)
 
     def save(self, *args, **kwargs):
         if not self.key:
             self.key = self.generate_key()
-            self.expiration = timezone.now() + timedelta(days=7)
+            self.expiration = timezone.now() + TOKEN_LIFETIME
         return super(Token, self).save(*args, **kwargs)
 
     def generate_key(self):
@@ -6,6 +6,7 @@ from phonenumber_field.modelfields import PhoneNumberField
 
 from users.allauth import UserModel, UserNode, LoginMutation, LogoutMutation
 from users.models import StudentClass
+from util.optimizer import QueryOptimizer
 
 
 # noinspection PyUnresolvedReferences
@@ -27,6 +28,11 @@ class Query(object):
     def resolve_me(self, info):
         user = info.context.user
         if isinstance(user, UserModel):
+            # the user was already loaded by the authentication backend; only load the requested relations
+            # (student profile, applications) into it
+            plan = QueryOptimizer(info).get_plan(UserModel)
+            if plan.has_relations:
+                plan.apply_to_instances([user])
             return user
         else:
             return None
@@ -0,0 +1,32 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users.backends import token_cache
+from users.models import Token, StudentClass, invalidate_student_classes
+
+UserModel = get_user_model()
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=UserModel)
+def user_changed(sender, instance, created, **kwargs):
+    # the cached copies of the user are stale now
+    if not created:
+        token_cache.delete(*Token.objects.filter(user=instance).values_list('key', flat=True))
+        token_cache.delete_user(instance.pk)
+
+
+@receiver(post_delete, sender=UserModel)
+def user_deleted(sender, instance, **kwargs):
+    token_cache.delete_user(instance.pk)
+
+
+@receiver(post_save, sender=StudentClass)
+@receiver(post_delete, sender=StudentClass)
+def student_class_changed(sender, **kwargs):
+    invalidate_student_classes()
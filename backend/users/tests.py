@@ -1,3 +1,423 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, AsyncClient, override_settings
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+
+import practica.urls
+from users import allauth
+from users.auth_service import AuthServiceClient, AuthServiceUnavailable
+from users.backends import get_token_user, issue_token, logout, revoke_signed_tokens, token_cache
+from users.models import StudentClass, get_student_class, STUDENT_CLASSES_CACHE_KEY, User, Token
+from users.tokens import default_signed_token_generator
+from students.models import StudentProfile
+
+
+class StubAuthService(object):
+    """
+    A local stand-in for the university auth service. ``delay``, ``status`` and ``response``
+    control how the next requests are answered.
+    """
+
+    def __init__(self):
+        self.delay = 0
+        self.status = 200
+        self.response = {'rezultat': {'marca': '1'}}
+        self.requests = []
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append((self.headers.get('X-API-KEY'), json.loads(body)))
+                time.sleep(stub.delay)
+
+                data = json.dumps(stub.response).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # clients that timed out have closed the connection already
+                pass
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AuthServiceClientTestCase(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubAuthService()
+        self.addCleanup(self.stub.stop)
+        self.auth_client = AuthServiceClient(self.stub.url, 'key', connect_timeout=1, read_timeout=0.2,
+                                        failure_threshold=2, reset_timeout=0.3)
+
+    def test_login(self):
+        self.assertEqual(self.auth_client.login('student@upt.ro', 'secret'), {'rezultat': {'marca': '1'}})
+        self.assertEqual(self.auth_client.login('student@upt.ro', 'secret'), {'rezultat': {'marca': '1'}})
+
+        api_key, payload = self.stub.requests[0]
+        self.assertEqual(api_key, 'key')
+        self.assertEqual(payload, {'cerere': {'cod': 0, 'utilizator': 'student@upt.ro', 'parola': 'secret'}})
+        self.assertEqual(self.auth_client.stats.as_dict()['requests'], 2)
+
+    def test_error_response_is_returned(self):
+        self.stub.status = 401
+        self.stub.response = {'eroare': {'descriere': 'Parola greșită'}}
+        self.assertEqual(self.auth_client.login('student@upt.ro', 'wrong'), self.stub.response)
+        self.assertFalse(self.auth_client.breaker.is_open)
+
+    def test_read_timeout(self):
+        self.stub.delay = 0.5
+        with self.assertRaises(AuthServiceUnavailable):
+            self.auth_client.login('student@upt.ro', 'secret')
+        self.assertEqual(self.auth_client.stats.as_dict()['failures'], 1)
+
+    def test_circuit_breaker(self):
+        self.stub.status = 503
+        for _ in range(2):
+            with self.assertRaises(AuthServiceUnavailable):
+                self.auth_client.login('student@upt.ro', 'secret')
+        self.assertTrue(self.auth_client.breaker.is_open)
+
+        # rejected without calling the service
+        with self.assertRaises(AuthServiceUnavailable):
+            self.auth_client.login('student@upt.ro', 'secret')
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(self.auth_client.stats.as_dict()['rejected'], 1)
+
+        # a trial call is let through after the reset timeout, and closes the circuit if it succeeds
+        time.sleep(0.3)
+        self.stub.status = 200
+        self.auth_client.login('student@upt.ro', 'secret')
+        self.assertFalse(self.auth_client.breaker.is_open)
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_stats_are_logged(self):
+        self.auth_client.stats.report_interval = 0.3
+        with self.assertLogs('users.auth_service', 'INFO') as logs:
+            self.auth_client.login('student@upt.ro', 'secret')
+            time.sleep(0.3)
+            self.auth_client.login('student@upt.ro', 'secret')
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("(periodic)", logs.output[0])
+        self.assertIn("'requests': 2", logs.output[0])
+
+        self.stub.status = 503
+        with self.assertLogs('users.auth_service', 'INFO') as logs:
+            for _ in range(2):
+                with self.assertRaises(AuthServiceUnavailable):
+                    self.auth_client.login('student@upt.ro', 'secret')
+        opened = [line for line in logs.output if "(circuit opened)" in line]
+        self.assertEqual(len(opened), 1)
+        self.assertIn("'failures': 2", opened[0])
+
+        time.sleep(0.3)
+        self.stub.status = 200
+        with self.assertLogs('users.auth_service', 'INFO') as logs:
+            self.auth_client.login('student@upt.ro', 'secret')
+        self.assertEqual([record.getMessage().split(':')[0] for record in logs.records],
+                         ["auth service stats (circuit closed)"])
+
+
+class GraphQLLoginTestCase(TransactionTestCase):
+    query = 'mutation Login($email: String!, $password: String!) {' \
+            '  login(input: {email: $email, password: $password}) { token { key } me { email } }' \
+            '}'
+
+    def setUp(self):
+        cache.clear()
+        token_cache.local.clear()
+        self.stub = StubAuthService()
+        self.addCleanup(self.stub.stop)
+        self.user = User.objects.create(email='student@stud.acs.upb.ro', username='student', reg='1')
+
+        patcher = mock.patch('users.auth_service._client', AuthServiceClient(self.stub.url, 'key'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.load_urls)
+
+    @staticmethod
+    def load_urls(server_mode=None):
+        with override_settings(SERVER_MODE=server_mode or settings.SERVER_MODE):
+            importlib.reload(practica.urls)
+        clear_url_caches()
+
+    def test_server_mode_selects_the_view(self):
+        for server_mode, is_async in (('wsgi', False), ('asgi', True)):
+            self.load_urls(server_mode)
+            self.assertEqual(asyncio.iscoroutinefunction(resolve('/graphql').func), is_async)
+
+    def test_asgi_login(self):
+        self.load_urls('asgi')
+        threads = []
+        external_login = allauth.do_external_login
+
+        def do_external_login(email, password):
+            threads.append(threading.current_thread().name)
+            return external_login(email, password)
+
+        with mock.patch.object(allauth, 'do_external_login', do_external_login):
+            response = async_to_sync(AsyncClient().post)(
+                '/graphql', {'query': self.query, 'variables': {'email': self.user.email, 'password': 'secret'}},
+                content_type='application/json',
+            )
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()['data']['login']
+        self.assertEqual(data['me']['email'], self.user.email)
+        self.assertEqual(get_token_user(data['token']['key']), self.user)
+        self.assertEqual(len(self.stub.requests), 1)
+        # executed by the pool, not on the event loop
+        self.assertTrue(threads[0].startswith('graphql'))
+
+
+class StudentClassLookupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student_class = StudentClass.objects.create(name='CTI Engleză', study_year=3)
+
+    def test_lookup_ignores_case_and_spaces(self):
+        with self.assertNumQueries(1):
+            for name, study_year in (('CTI Engleză', 3), ('cti engleză', '3'), (' CTI ENGLEZĂ ', ' 3')):
+                self.assertEqual(get_student_class(name, study_year), self.student_class)
+        self.assertEqual(len(cache.get(STUDENT_CLASSES_CACHE_KEY)), 1)
+
+        self.assertIsNone(get_student_class('CTI', 3))
+        self.assertIsNone(get_student_class('CTI Engleză', 2))
+
+    def test_cache_is_invalidated_when_classes_change(self):
+        self.assertIsNone(get_student_class('IS', 2))
+        student_class = StudentClass.objects.create(name='IS', study_year=2)
+        self.assertEqual(get_student_class('is', 2), student_class)
+
+
+class PurgeTokensTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(email='student@stud.acs.upb.ro', username='student')
+
+    def test_purge_once(self):
+        expired = [Token.objects.create(user=self.user) for _ in range(3)]
+        Token.objects.filter(pk__in=[token.pk for token in expired]) \
+            .update(expiration=timezone.now() - timedelta(seconds=1))
+        valid = Token.objects.create(user=self.user)
+
+        call_command('purge_tokens', batch_size=2)
+        self.assertEqual(list(Token.objects.all()), [valid])
+
+    def test_loop_survives_errors(self):
+        class Stop(Exception):
+            pass
+
+        purges = mock.Mock(side_effect=[OperationalError('database is down'), 0, 0])
+        sleeps = mock.Mock(side_effect=[None, None, Stop()])
+        with mock.patch('users.management.commands.purge_tokens.purge_expired_tokens', purges), \
+                mock.patch('users.management.commands.purge_tokens.time.sleep', sleeps), \
+                self.assertLogs('users.management.commands.purge_tokens', 'ERROR'):
+            with self.assertRaises(Stop):
+                call_command('purge_tokens', interval=3600, retry_delay=5)
+
+        self.assertEqual(purges.call_count, 3)
+        self.assertEqual([c.args[0] for c in sleeps.call_args_list], [5, 3600, 3600])
+
+
+class TokenAuthTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.local.clear()
+        self.user = User.objects.create(email='student@stud.acs.upb.ro', username='student')
+        self.other_user = User.objects.create(email='other@stud.acs.upb.ro', username='other')
+
+    def make_request(self, user, token):
+        request = RequestFactory().post('/graphql', HTTP_AUTHORIZATION=f'Bearer {token}')
+        request.user = user
+        request.session = SessionStore()
+        return request
+
+    def assertTokenUser(self, token, user, queries=0):
+        with self.assertNumQueries(queries):
+            self.assertEqual(get_token_user(token), user)
+
+    def test_token_user_is_cached(self):
+        token = issue_token(self.user).key
+        self.assertTokenUser(token, self.user, queries=1)
+        self.assertTokenUser(token, self.user)
+
+        # a copy per request, so changes to it don't leak into the cache
+        get_token_user(token).first_name = 'Changed'
+        self.assertEqual(get_token_user(token).first_name, '')
+
+        # the shared cache is used once the per-process copy is gone
+        token_cache.local.clear()
+        self.assertTokenUser(token, self.user)
+
+        self.assertTokenUser('invalid', None, queries=1)
+
+    def test_token_is_evicted_on_logout(self):
+        token = issue_token(self.user).key
+        other_token = Token.objects.create(user=self.user).key
+        get_token_user(token)
+        get_token_user(other_token)
+
+        self.assertTrue(logout(self.make_request(self.user, token)))
+        self.assertTokenUser(token, None, queries=1)
+        self.assertTokenUser(other_token, self.user)
+
+        # can't delete the tokens of someone else
+        self.assertFalse(logout(self.make_request(self.other_user, other_token)))
+        self.assertTokenUser(other_token, self.user)
+
+        self.assertTrue(logout(self.make_request(self.user, other_token)))
+        self.assertTokenUser(other_token, None, queries=1)
+
+    def test_token_is_evicted_on_user_change(self):
+        token = issue_token(self.user).key
+        get_token_user(token)
+
+        self.user.first_name = 'Ana'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(get_token_user(token).first_name, 'Ana')
+
+        self.user.delete()
+        self.assertTokenUser(token, None, queries=1)
+
+    def test_logout_all_keeps_the_request_token(self):
+        token = Token.objects.create(user=self.user).key
+        other_tokens = [Token.objects.create(user=self.user).key for _ in range(2)]
+        other_user_token = Token.objects.create(user=self.other_user).key
+        for t in [token, *other_tokens, other_user_token]:
+            get_token_user(t)
+
+        self.assertTrue(logout(self.make_request(self.user, token), all_tokens=True))
+        self.assertEqual(set(Token.objects.values_list('key', flat=True)), {token, other_user_token})
+        for t in other_tokens:
+            self.assertTokenUser(t, None, queries=1)
+        self.assertTokenUser(other_user_token, self.other_user)
+
+
+@override_settings(TOKEN_MODE='signed')
+class SignedTokenTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.local.clear()
+        self.user = User.objects.create(email='student@stud.acs.upb.ro', username='student')
+
+    def make_request(self, token):
+        request = RequestFactory().post('/graphql', HTTP_AUTHORIZATION=f'Bearer {token}')
+        request.user = self.user
+        request.session = SessionStore()
+        return request
+
+    def test_signed_token(self):
+        token = issue_token(self.user)
+        self.assertFalse(Token.objects.exists())
+        self.assertTrue(default_signed_token_generator.is_signed(token.key))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(get_token_user(token.key), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_token_user(token.key), self.user)
+
+    def test_tampered_token_is_rejected(self):
+        token = issue_token(self.user).key
+        prefix = default_signed_token_generator.prefix
+        payload, signature = token[len(prefix):].rsplit(':', 1)
+
+        other_payload = signing.dumps([self.user.pk + 1, 2 ** 40, 0], salt='other').rsplit(':', 1)[0]
+        for tampered in (token[:-1] + ('A' if token[-1] != 'A' else 'B'),
+                         f'{prefix}{other_payload}:{signature}',
+                         prefix + signing.dumps([self.user.pk, 2 ** 40, 0], salt='other'),
+                         f'{prefix}{payload}',
+                         prefix):
+            with self.assertNumQueries(0):
+                self.assertIsNone(get_token_user(tampered))
+
+    def test_expired_token_is_rejected(self):
+        token = issue_token(self.user).key
+        with mock.patch('users.tokens.timezone.now', return_value=timezone.now() + timedelta(days=365)):
+            self.assertIsNone(get_token_user(token))
+        self.assertEqual(get_token_user(token), self.user)
+
+    def test_revocation(self):
+        token = issue_token(self.user).key
+        get_token_user(token)
+
+        revoke_signed_tokens(self.user)
+        self.assertIsNone(get_token_user(token))
+
+        self.user.refresh_from_db()
+        new_token = issue_token(self.user).key
+        self.assertEqual(get_token_user(new_token), self.user)
+
+        # revoking one token revokes them all, including the one used for the request
+        self.assertTrue(logout(self.make_request(new_token), target_token=token))
+        self.assertIsNone(get_token_user(new_token))
+
+        self.user.refresh_from_db()
+        token = issue_token(self.user).key
+        self.assertTrue(logout(self.make_request(token), all_tokens=True))
+        self.assertIsNone(get_token_user(token))
+
+
+class MeQueryTestCase(TestCase):
+    query = '{ me { email student { phone studyClass { name } applications { edges { node { title } } } } } }'
+
+    def setUp(self):
+        cache.clear()
+        token_cache.local.clear()
+        study_class = StudentClass.objects.create(name='CTI', study_year=3)
+        self.user = User.objects.create(email='student@stud.acs.upb.ro', username='student')
+        StudentProfile.objects.create(user=self.user, study_class=study_class)
+        self.token = issue_token(self.user).key
+
+    def run_query(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/graphql', {'query': query}, content_type='application/json',
+                                        HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('errors', response.json())
+        return response.json()['data']['me'], [query['sql'] for query in queries]
+
+    def test_relations_are_loaded_into_the_authenticated_user(self):
+        # the first request caches the token
+        self.run_query('{ me { email } }')
+        me, queries = self.run_query('{ me { email } }')
+        self.assertEqual(me, {'email': self.user.email})
+        self.assertEqual(queries, [])
+
+        # the profile joined with its class, and the applications
+        me, queries = self.run_query(self.query)
+        self.assertEqual(me['student']['studyClass'], {'name': 'CTI'})
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(any('"users_user"' in sql.split(' WHERE ')[0].split(' FROM ')[1] for sql in queries))
@@ -0,0 +1,52 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core import signing
+from django.utils import timezone
+
+from users.models import Token, TOKEN_LIFETIME
+
+
+class SignedAccessTokenGenerator(object):
+    """
+    Self-contained access tokens: an HMAC-signed (user id, expiration, token version) triple, so they
+    can be validated without a ``Token`` row. Bumping ``User.token_version`` revokes all of a user's
+    signed tokens at once.
+    """
+    key_salt = "practica.SignedAccessTokenGenerator"
+    # DB token keys are hex strings, so the prefix tells the two formats apart
+    prefix = 's1.'
+
+    def make_token(self, user):
+        """
+        Return an unsaved ``Token`` holding a signed token for ``user``, to be handed to the client.
+        """
+        created = timezone.now()
+        expiration = created + TOKEN_LIFETIME
+        payload = [user.pk, int(expiration.timestamp()), user.token_version]
+        key = self.prefix + signing.dumps(payload, salt=self.key_salt)
+        return Token(key=key, user=user, created=created, expiration=expiration)
+
+    def is_signed(self, token):
+        return bool(token) and token.startswith(self.prefix)
+
+    def parse_token(self, token):
+        """
+        Return ``(user id, expiration, token version)`` if ``token`` is a correctly signed, unexpired token,
+        or ``None`` otherwise. The token version still has to be checked against the user's.
+        """
+        if not self.is_signed(token):
+            return None
+
+        try:
+            user_id, expires_at, version = signing.loads(token[len(self.prefix):], salt=self.key_salt)
+        except (signing.BadSignature, TypeError, ValueError):
+            return None
+
+        expiration = datetime.fromtimestamp(expires_at, tz=dt_timezone.utc)
+        if expiration < timezone.now():
+            return None
+
+        return user_id, expiration, version
+
+
+default_signed_token_generator = SignedAccessTokenGenerator()
@@ -1,6 +1,43 @@
+import csv
+import io
+from tempfile import TemporaryFile
+
 from django.contrib import admin
-from django.db.models import Q
+from django.db.models import Q, Exists, OuterRef, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django.utils.translation import gettext_lazy as _
+from import_export.formats import base_formats
+from import_export.signals import post_export
+from openpyxl import Workbook
+
+from util.middleware import get_current_request, iter_in_request_context
+
+
+def get_staff_group_ids(request=None):
+    """
+    Return the ids of the groups of a staff member, which limit the companies they can see, or ``None``
+    for users that see all of them. Resolved once per request; defaults to the current request.
+    """
+    request = request or get_current_request()
+    if request is None:
+        return None
+    if not hasattr(request, '_staff_group_ids'):
+        user = request.user
+        request._staff_group_ids = list(user.groups.values_list('pk', flat=True)) \
+            if user.is_staff and not user.is_superuser else None
+    return request._staff_group_ids
+
+
+def has_related(model, field):
+    """
+    Return a condition on ``model`` that is true when the lookup path ``field`` leads to a related object.
+    Relations that may match several rows are checked with a correlated ``EXISTS`` subquery, which is answered
+    from the foreign key indexes and never duplicates rows, unlike a join that then has to be made distinct.
+    """
+    model_field = model._meta.get_field(field.split('__', 1)[0])
+    if '__' not in field and model_field.concrete and not model_field.many_to_many:
+        return Q(**{f'{field}__isnull': False})
+    return Exists(model._default_manager.filter(pk=OuterRef('pk'), **{f'{field}__isnull': False}))
 
 
 def get_nested_filters(label, field):
@@ -18,8 +55,8 @@ def get_nested_filters(label, field):
             if self.value() not in ('0', '1'):
                 return queryset
 
-            is_null = Q(**{f'{field}__isnull': True})
-            return queryset.filter(is_null if self.value() == '0' else ~is_null).distinct()
+            condition = has_related(queryset.model, field)
+            return queryset.filter(condition if self.value() == '1' else ~condition)
 
     return RelatedExistsListFilter
 
@@ -33,3 +70,110 @@ def add_nested_filters(fields):
         return cls
 
     return decorator
+
+
+class StreamingExportMixin(object):
+    """
+    Mixin for import-export admins that streams CSV and XLSX exports instead of building a tablib ``Dataset``
+    in memory. The rows are read with ``QuerySet.iterator`` in chunks of ``export_chunk_size``, prefetching
+    the related objects of every chunk. CSV is sent as it is generated; XLSX is written in openpyxl's write-only
+    mode to a temporary file, as the archive can only be sent once complete. Other formats are exported as usual.
+
+    Must come before ``ExportMixin`` (or ``ExportActionModelAdmin``) in the bases.
+    """
+    export_chunk_size = 500
+    export_select_related = ()
+    export_prefetch_related = ()
+    export_buffer_size = 64 * 1024
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        # ExportActionMixin registers its own function, which would bypass the streaming export
+        if 'export_admin_action' in actions:
+            _, name, description = actions['export_admin_action']
+            actions['export_admin_action'] = (type(self).export_admin_action, name, description)
+        return actions
+
+    def can_stream_export(self, file_format):
+        return isinstance(file_format, (base_formats.CSV, base_formats.XLSX))
+
+    def export_action(self, request, *args, **kwargs):
+        if request.method == 'POST' and self.has_export_permission(request):
+            formats = self.get_export_formats()
+            form = self.get_export_form()(formats, request.POST)
+            if form.is_valid():
+                file_format = formats[int(form.cleaned_data['file_format'])]()
+                if self.can_stream_export(file_format):
+                    return self.get_streaming_export_response(request, self.get_export_queryset(request),
+                                                              file_format)
+        return super().export_action(request, *args, **kwargs)
+
+    def export_admin_action(self, request, queryset):
+        export_format = request.POST.get('file_format')
+        if export_format and self.has_export_permission(request):
+            file_format = self.get_export_formats()[int(export_format)]()
+            if self.can_stream_export(file_format):
+                return self.get_streaming_export_response(request, queryset, file_format)
+        return super().export_admin_action(request, queryset)
+
+    def get_streaming_export_response(self, request, queryset, file_format):
+        rows = self.get_export_rows(request, queryset)
+        if isinstance(file_format, base_formats.XLSX):
+            chunks = self.get_xlsx_chunks(rows)
+        else:
+            chunks = self.get_csv_chunks(rows)
+
+        response = StreamingHttpResponse(iter_in_request_context(chunks), content_type=file_format.get_content_type())
+        response['Content-Disposition'] = 'attachment; filename="%s"' % (
+            self.get_export_filename(request, queryset, file_format),
+        )
+        post_export.send(sender=None, model=self.model)
+        return response
+
+    def iter_export_queryset(self, queryset):
+        # QuerySet.iterator ignores prefetch_related, so the lookups are done for every chunk instead
+        lookups = list(queryset._prefetch_related_lookups) + list(self.export_prefetch_related)
+        queryset = queryset.prefetch_related(None)
+        if self.export_select_related:
+            queryset = queryset.select_related(*self.export_select_related)
+
+        chunk = []
+        for obj in queryset.iterator(chunk_size=self.export_chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= self.export_chunk_size:
+                prefetch_related_objects(chunk, *lookups)
+                yield from chunk
+                chunk = []
+        prefetch_related_objects(chunk, *lookups)
+        yield from chunk
+
+    def get_export_rows(self, request, queryset):
+        resource = self.get_export_resource_class()(**self.get_export_resource_kwargs(request))
+        yield resource.get_export_headers()
+        for obj in self.iter_export_queryset(queryset):
+            yield [value if value is None or isinstance(value, (int, float)) else str(value)
+                   for value in resource.export_resource(obj)]
+
+    def get_csv_chunks(self, rows):
+        encoding = self.to_encoding or 'utf-8'
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() >= self.export_buffer_size:
+                yield buffer.getvalue().encode(encoding)
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode(encoding)
+
+    def get_xlsx_chunks(self, rows):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        for row in rows:
+            sheet.append(row)
+
+        with TemporaryFile() as xlsx_file:
+            workbook.save(xlsx_file)
+            xlsx_file.seek(0)
+            yield from iter(lambda: xlsx_file.read(self.export_buffer_size), b'')
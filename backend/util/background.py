@@ -0,0 +1,63 @@
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the process pool used for background tasks, creating it on first use.
+
+    Workers are spawned rather than forked, so they never share database connections or other
+    state with the web process; each one sets up django on its own.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.BACKGROUND_TASK_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        return _executor
+
+
+def run_in_background(func, *args, callback=None):
+    """
+    Run ``func(*args)`` in the background process pool. ``func`` and its arguments must be picklable.
+
+    If given, ``callback(result)`` is called in this process once ``func`` finishes, from a pool thread;
+    it is the place to write the results to the database.
+
+    With ``BACKGROUND_TASK_WORKERS = 0`` everything runs synchronously, which is useful in development and tests.
+    """
+    if not settings.BACKGROUND_TASK_WORKERS:
+        result = func(*args)
+        if callback:
+            callback(result)
+        return
+
+    submitter = threading.get_ident()
+
+    def done(future):
+        try:
+            result = future.result()
+            if callback:
+                callback(result)
+        except Exception:
+            logger.exception("background task %s%r failed", func.__name__, args)
+        finally:
+            # a pool thread gets its own database connection, which nothing else would close
+            if threading.get_ident() != submitter:
+                connection.close()
+
+    get_executor().submit(func, *args).add_done_callback(done)
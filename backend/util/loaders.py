@@ -0,0 +1,90 @@
+from collections import defaultdict
+
+from django.db.models import F
+from promise import Promise
+from promise.dataloader import DataLoader
+
+
+class RelatedListLoader(DataLoader):
+    """
+    Loads a many-valued relation (reverse foreign key or many-to-many) for a batch of parent objects
+    in a single query. Keys are parent primary keys, values are lists of related objects.
+    """
+
+    def __init__(self, queryset, parent_lookup):
+        super().__init__()
+        self.queryset = queryset
+        self.parent_lookup = parent_lookup
+
+    def batch_load_fn(self, keys):
+        related = defaultdict(list)
+        queryset = self.queryset \
+            .filter(**{f'{self.parent_lookup}__in': keys}) \
+            .annotate(loader_parent_pk=F(self.parent_lookup))
+        for obj in queryset:
+            related[obj.loader_parent_pk].append(obj)
+
+        return Promise.resolve([related[key] for key in keys])
+
+
+class InstanceLoader(DataLoader):
+    """
+    Loads objects by primary key in a single query. Used for the target of single-valued relations.
+    """
+
+    def __init__(self, queryset):
+        super().__init__()
+        self.queryset = queryset
+
+    def batch_load_fn(self, keys):
+        objects = self.queryset.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+def get_loader(info, key, factory):
+    """
+    Return the DataLoader stored under ``key`` for the current request, creating it with ``factory`` if needed.
+    Loaders are kept on the request so their cache never outlives it.
+    """
+    loaders = getattr(info.context, 'dataloaders', None)
+    if loaders is None:
+        loaders = info.context.dataloaders = {}
+
+    if key not in loaders:
+        loaders[key] = factory()
+
+    return loaders[key]
+
+
+def load_related(info, instance, field_name):
+    """
+    Resolve the ``field_name`` relation of ``instance`` through a request-scoped DataLoader, so the
+    same relation of every object resolved in the request is fetched with a single query.
+
+    Returns a promise of a list for many-valued relations and a single object (or ``None``) otherwise.
+    Relations that were already fetched (e.g. by ``prefetch_related`` or ``select_related``) are returned as-is.
+    """
+    field = instance._meta.get_field(field_name)
+    loader_key = (instance._meta.label, field_name)
+    related_queryset = field.related_model._default_manager.all()
+
+    if field.many_to_many or field.one_to_many:
+        prefetched = getattr(instance, '_prefetched_objects_cache', {})
+        cache_name = field.get_cache_name() if field.auto_created else field_name
+        if cache_name in prefetched:
+            return Promise.resolve(list(prefetched[cache_name]))
+
+        # the lookup that leads back from the related model to ``instance``
+        parent_lookup = field.field.name if field.auto_created else field.related_query_name()
+        loader = get_loader(info, loader_key, lambda: RelatedListLoader(related_queryset, parent_lookup))
+        return loader.load(instance.pk)
+
+    if field.is_cached(instance):
+        return getattr(instance, field_name)
+
+    related_pk = getattr(instance, field.attname)
+    if related_pk is None:
+        return None
+
+    loader = get_loader(info, loader_key, lambda: InstanceLoader(related_queryset))
+    return loader.load(related_pk)
@@ -0,0 +1,44 @@
+import contextvars
+
+# the request being handled by the current thread or task
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+def get_current_request():
+    """
+    Return the request being handled, for code that is shared between requests and isn't passed it,
+    like admin list columns and import-export resources. ``None`` outside of a request.
+    """
+    return current_request.get()
+
+
+def iter_in_request_context(iterable):
+    """
+    Iterate ``iterable`` in the context of the current request, e.g. the content of a streaming response,
+    which is only consumed once the middleware returned.
+    """
+    context = contextvars.copy_context()
+    iterator = iter(iterable)
+    while True:
+        try:
+            yield context.run(next, iterator)
+        except StopIteration:
+            return
+
+
+class CurrentRequestMiddleware(object):
+    """
+    Makes the request available through ``get_current_request``. Unlike state stored on the (shared) admin
+    instances, a context variable is local to the thread or task handling the request, so concurrent requests
+    never see each other's.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = current_request.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            current_request.reset(token)
@@ -0,0 +1,193 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Manager, QuerySet, Prefetch, prefetch_related_objects
+from graphene.relay import Connection
+from graphene.utils.str_converters import to_snake_case
+from graphql import GraphQLList, GraphQLNonNull
+from graphql.language.ast import Field as FieldAST, FragmentSpread, InlineFragment
+
+
+def unwrap_type(gql_type):
+    while isinstance(gql_type, (GraphQLList, GraphQLNonNull)):
+        gql_type = gql_type.of_type
+    return gql_type
+
+
+class QueryOptimizer(object):
+    """
+    Applies ``only()``, ``select_related()`` and ``prefetch_related()`` to a queryset based on the
+    fields requested in the GraphQL selection set that resolves it.
+
+    Graphene fields are matched to model fields by name. Fields backed by custom resolvers can declare
+    the model fields they read in an ``optimizer_hints`` dict on the node type; if a selected field cannot
+    be matched at all, ``only()`` is skipped so no column the resolver might read gets deferred.
+    """
+
+    def __init__(self, info):
+        self.info = info
+
+    def optimize(self, queryset, field_asts=None, gql_type=None):
+        if isinstance(queryset, Manager):
+            queryset = queryset.all()
+        if not isinstance(queryset, QuerySet):
+            return queryset
+
+        return self.get_plan(queryset.model, field_asts, gql_type).apply(queryset)
+
+    def get_plan(self, model, field_asts=None, gql_type=None):
+        field_asts = self.info.field_asts if field_asts is None else field_asts
+        gql_type = self.info.return_type if gql_type is None else gql_type
+        selections, gql_type = self.get_node_selections(field_asts, gql_type)
+
+        plan = QueryPlan()
+        self.collect(plan, model, selections, gql_type, prefix='')
+        return plan
+
+    def get_selected_fields(self, field_asts):
+        """
+        Yield the ``Field`` nodes selected under ``field_asts``, expanding fragments.
+        """
+        for field_ast in field_asts:
+            if not field_ast.selection_set:
+                continue
+            for selection in field_ast.selection_set.selections:
+                if isinstance(selection, FieldAST):
+                    yield selection
+                elif isinstance(selection, FragmentSpread):
+                    yield from self.get_selected_fields([self.info.fragments[selection.name.value]])
+                elif isinstance(selection, InlineFragment):
+                    yield from self.get_selected_fields([selection])
+
+    def get_node_selections(self, field_asts, gql_type):
+        """
+        Return the selections made on the node type, looking through relay connections (``edges { node }``).
+        """
+        gql_type = unwrap_type(gql_type)
+        graphene_type = getattr(gql_type, 'graphene_type', None)
+        if graphene_type and issubclass(graphene_type, Connection):
+            edges = [f for f in self.get_selected_fields(field_asts) if f.name.value == 'edges']
+            edge_type = unwrap_type(gql_type.fields['edges'].type)
+            nodes = [f for f in self.get_selected_fields(edges) if f.name.value == 'node']
+            return nodes, unwrap_type(edge_type.fields['node'].type)
+
+        return field_asts, gql_type
+
+    def collect(self, plan, model, field_asts, gql_type, prefix):
+        hints = getattr(getattr(gql_type, 'graphene_type', None), 'optimizer_hints', {})
+
+        for field_ast in self.get_selected_fields(field_asts):
+            name = field_ast.name.value
+            if name == '__typename':
+                continue
+
+            attname = to_snake_case(name)
+            if attname in hints:
+                plan.only.update(prefix + hint for hint in hints[attname])
+                continue
+
+            if attname == 'id':
+                continue
+
+            try:
+                model_field = model._meta.get_field(attname)
+            except FieldDoesNotExist:
+                plan.can_defer = False
+                continue
+
+            if name not in gql_type.fields:
+                # selected through a fragment on another type, e.g. on the relay Node interface
+                plan.can_defer = False
+                continue
+
+            child_type = gql_type.fields[name].type
+            if model_field.many_to_many or model_field.one_to_many:
+                plan.prefetch[prefix + attname] = self.get_prefetch_queryset(model_field, [field_ast], child_type)
+            elif model_field.is_relation:
+                plan.select_related.add(prefix + attname)
+                if model_field.concrete:
+                    plan.only.add(prefix + attname)
+                child_asts, child_type = self.get_node_selections([field_ast], child_type)
+                self.collect(plan, model_field.related_model, child_asts, child_type, prefix + attname + '__')
+            else:
+                plan.only.add(prefix + attname)
+
+    def get_prefetch_queryset(self, model_field, field_asts, gql_type):
+        related_model = model_field.related_model
+        queryset = self.optimize(related_model._default_manager.all(), field_asts, gql_type)
+
+        only = queryset.query.deferred_loading[0]
+        if only:
+            extra = set()
+            if model_field.one_to_many:
+                # the foreign key is needed to match the prefetched objects to their parent
+                extra.add(model_field.field.name)
+            for field_ast in field_asts:
+                # filter arguments are matched against the prefetched objects
+                for argument in field_ast.arguments:
+                    name = to_snake_case(argument.name.value)
+                    if any(f.name == name for f in related_model._meta.concrete_fields):
+                        extra.add(name)
+            queryset = queryset.only(*only, *extra)
+
+        return queryset
+
+
+class QueryPlan(object):
+    def __init__(self):
+        self.only = set()
+        self.select_related = set()
+        self.prefetch = {}
+        self.can_defer = True
+
+    @property
+    def has_relations(self):
+        return bool(self.select_related or self.prefetch)
+
+    def apply(self, queryset):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch:
+            queryset = queryset.prefetch_related(*[Prefetch(path, queryset=qs) for path, qs in self.prefetch.items()])
+        if self.can_defer and self.only:
+            queryset = queryset.only(*sorted(self.only))
+        return queryset
+
+    def get_subplan(self, relation):
+        """
+        Return the part of the plan below ``relation``, a relation that is joined from the root model.
+        """
+        prefix = relation + '__'
+        plan = QueryPlan()
+        plan.only = {name[len(prefix):] for name in self.only if name.startswith(prefix)}
+        plan.select_related = {name[len(prefix):] for name in self.select_related if name.startswith(prefix)}
+        plan.prefetch = {path[len(prefix):]: qs for path, qs in self.prefetch.items() if path.startswith(prefix)}
+        plan.can_defer = self.can_defer
+        return plan
+
+    def apply_to_instances(self, instances):
+        """
+        Load the relations of the plan into already loaded ``instances`` of the root model, instead of
+        loading the instances again. Each joined relation is fetched with a query of its own, which joins
+        the relations below it in turn.
+        """
+        if not instances:
+            return
+
+        model = instances[0]._meta.model
+        lookups = []
+        for relation in sorted(name for name in self.select_related if '__' not in name):
+            model_field = model._meta.get_field(relation)
+            subplan = self.get_subplan(relation)
+            if subplan.only and not model_field.concrete:
+                # the reverse side of a one-to-one: its foreign key matches it to the instances
+                subplan.only.add(model_field.field.name)
+            lookups.append(Prefetch(relation, queryset=subplan.apply(model_field.related_model._default_manager.all())))
+        lookups.extend(Prefetch(path, queryset=qs) for path, qs in self.prefetch.items() if '__' not in path)
+
+        prefetch_related_objects(instances, *lookups)
+
+
+def optimize_queryset(queryset, info):
+    """
+    Optimize ``queryset`` for the selection set of the field being resolved. See ``QueryOptimizer``.
+    """
+    return QueryOptimizer(info).optimize(queryset)
@@ -2,8 +2,10 @@ import graphene
 from graphene import ClientIDMutation, InputField
 from graphene.types.mutation import MutationOptions
 from graphene.types.utils import yank_fields_from_attrs
+from graphene_django.filter import DjangoFilterConnectionField
 from graphene_django.rest_framework.mutation import fields_for_serializer
 from graphene_django.rest_framework.serializer_converter import get_graphene_type_from_serializer_field
+from promise import Promise
 from rest_framework import serializers
 
 
@@ -22,6 +24,27 @@ def convert_serializer_field_to_related_list(field: serializers.ManyRelatedField
     return graphene.List, get_graphene_type_from_serializer_field(field.child_relation)
 
 
+class BatchedFilterConnectionField(DjangoFilterConnectionField):
+    """
+    A ``DjangoFilterConnectionField`` whose resolver may also return a promise of a list, e.g. from a DataLoader.
+
+    Lists cannot go through the filterset, so the filter arguments are applied in python as exact matches.
+    Only use this with filtersets made of plain ``exact`` lookups.
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        if not Promise.is_thenable(iterable):
+            return super().resolve_queryset(connection, iterable, info, args, filtering_args, filterset_class)
+
+        filters = {name: value for name, value in args.items() if name in filtering_args and value is not None}
+
+        def apply_filters(items):
+            return [item for item in items if all(getattr(item, name) == value for name, value in filters.items())]
+
+        return Promise.resolve(iterable).then(apply_filters)
+
+
 class SerializerMutationOptions(MutationOptions):
     serializer_class = None
 
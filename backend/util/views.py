@@ -0,0 +1,51 @@
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections
+from graphene_django.views import GraphQLView
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Return the thread pool that GraphQL requests are executed in under ASGI, creating it on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.GRAPHQL_THREADS, thread_name_prefix='graphql')
+        return _executor
+
+
+class AsyncGraphQLView(GraphQLView):
+    """
+    ``GraphQLView`` for the ASGI deployment. graphql-core executes resolvers synchronously, so each request
+    is executed in a thread from ``get_executor()`` while the event loop keeps serving other requests.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        sync_view = super().as_view(**initkwargs)
+
+        def run_view(request, *args, **kwargs):
+            # the pool threads outlive the request, so their connections aren't closed by request_finished
+            close_old_connections()
+            try:
+                return sync_view(request, *args, **kwargs)
+            finally:
+                close_old_connections()
+
+        async def view(request, *args, **kwargs):
+            loop = asyncio.get_running_loop()
+            # so the resolvers see the context variables of the request
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(get_executor(), partial(context.run, run_view, request, *args, **kwargs))
+
+        view.csrf_exempt = True
+        return view
@@ -0,0 +1,91 @@
+import os
+import struct
+import time
+import zlib
+from types import SimpleNamespace
+
+import zipseeker
+from zipseeker import (ZIP_VERSION, FLAGS, BLOCKSIZE, EXTERNAL_ATTRIBUTES, USE_DATA_DESCRIPTOR, ZipFile,
+                       ZipFileChanged)
+
+
+class GeneratedZipFile(ZipFile):
+    """
+    A ZIP entry whose content is produced by ``chunks()`` instead of being read from a file.
+    The total size must be known in advance, so the archive size can be computed before streaming it.
+    """
+
+    def __init__(self, chunks, zipname, size, mtime, offset):
+        super().__init__(None, zipname, SimpleNamespace(st_size=size, st_mtime=mtime), offset)
+        self.chunks = chunks
+
+
+class StreamingZipSeeker(zipseeker.ZipSeeker):
+    """
+    ``ZipSeeker`` that can also stream generated entries (see ``add_generated``), so nothing has to be
+    written to disk to be included in the archive. Like ``ZipSeeker``, the archive is not compressed, which
+    is what makes its size known before it is generated.
+    """
+
+    def add_generated(self, chunks, zipname, size, mtime=None):
+        """
+        Add an entry with the bytes yielded by ``chunks()``, which must add up to exactly ``size`` bytes.
+        ``chunks`` is only called while the archive is streamed.
+        """
+        offset = 0
+        if self.files:
+            offset = self.files[-1].localHeaderOffset + self.files[-1].localSize()
+        mtime = time.time() if mtime is None else mtime
+        self.files.append(GeneratedZipFile(chunks, zipname.encode('utf-8'), size, mtime, offset))
+
+    @staticmethod
+    def read_file(path):
+        with open(path, 'rb') as fp:
+            buf = fp.read(BLOCKSIZE)
+            while buf:
+                yield buf
+                buf = fp.read(BLOCKSIZE)
+
+    def blocks(self):
+        # the same layout as ZipSeeker.blocks, reading every entry through its chunks
+        for file in self.files:
+            yield struct.pack('<IccHHHHIIIHH', 0x04034b50, ZIP_VERSION, b'\x00', FLAGS, 0,
+                              file.dos_time(), file.dos_date(), 0, file.st.st_size, file.st.st_size,
+                              len(file.zipname), 0)
+            yield file.zipname
+
+            checksum = 0
+            size = 0
+            chunks = file.chunks() if isinstance(file, GeneratedZipFile) else self.read_file(file.path)
+            for buf in chunks:
+                size += len(buf)
+                if size > file.st.st_size:
+                    raise ZipFileChanged(f'{file.zipname!r} is at least {size - file.st.st_size} bytes too big')
+                checksum = zlib.crc32(buf, checksum) & 0xffffffff
+                yield buf
+            if size != file.st.st_size:
+                raise ZipFileChanged(f'{file.zipname!r} has {size} bytes instead of {file.st.st_size}')
+            file.checksum = checksum
+
+            if USE_DATA_DESCRIPTOR:
+                yield struct.pack('<IIII', 0x08074b50, checksum, size, size)
+
+        for file in self.files:
+            yield struct.pack('<IccccHHHHIIIHHHHHII', 0x02014b50, ZIP_VERSION, b'\x03', ZIP_VERSION, b'\x00',
+                              FLAGS, 0, file.dos_time(), file.dos_date(), file.checksum, file.st.st_size,
+                              file.st.st_size, len(file.zipname), 0, 0, 0, 0, EXTERNAL_ATTRIBUTES,
+                              file.localHeaderOffset)
+            yield file.zipname
+
+        yield struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self.files), len(self.files),
+                          self.centralDirectorySize(), self.centralDirectoryStart(), 0)
+
+
+def file_size(fileobj):
+    """
+    Return the size of an open file, leaving its position at the start.
+    """
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size